@@ -4,19 +4,27 @@
 
 # --- 1. STANDARD LIBRARIES ---
 import os
+import atexit
 import asyncio
 import logging
 import threading
 import json
 import time
+import heapq
 import csv
+import codecs
 import io
+import re
 import random
 import string
 import uuid
 from io import BytesIO
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from dataclasses import dataclass
 from functools import wraps 
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # --- 2. THIRD-PARTY LIBRARIES ---
 import httpx
@@ -26,11 +34,36 @@ import base64
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, send_from_directory, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 
 # --- 3. CORE SERVICES (TELETHON & SUPABASE) ---
 from telethon import TelegramClient, errors, functions, types, utils, events
 from telethon.sessions import StringSession
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+
+# Driver Postgres langsung (opsional) -> dipake buat bulk import CSV via COPY
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# orjson (opsional) -> encoder JSON berbasis C buat jsonify / tojson
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Aho-Corasick (opsional) -> scan keyword auto-reply 1x jalan per pesan
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Redis (opsional) -> state flag lintas worker gunicorn (stop broadcast, cooldown OTP)
+try:
+    import redis
+except ImportError:
+    redis = None
 
 # --- 4. BLASTPRO CUSTOM MODULES (SECURITY & MAILER) ---
 # Memanggil The 7 Gates of Hell dari folder utils
@@ -56,6 +89,33 @@ logger = logging.getLogger("BlastPro_Core")
 # Initialize Flask Application
 app = Flask(__name__)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    jsonify / tojson pake orjson kalau terinstall.
+    Panggilan dengan opsi lain (indent, separators -> mis. serializer cookie session) tetep lewat json bawaan.
+    """
+    # PASSTHROUGH_DATETIME: datetime/date dilempar ke default() -> tetep HTTP date (RFC 822) kayak provider bawaan Flask,
+    # bukan ISO-8601 versi orjson (format di wire gak berubah buat JS dashboard)
+    OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        # tojson Jinja ngirim sort_keys=True -> diterjemahin ke opsi orjson
+        option = self.OPTIONS | (orjson.OPT_SORT_KEYS if kwargs.pop('sort_keys', False) else 0)
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def response(self, *args, **kwargs):
+        # Mode debug (indent) tetep pake bawaan; selain itu bytes orjson langsung jadi body
+        if self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=self.OPTIONS) + b"\n",
+                                        mimetype=self.mimetype)
+
+if orjson:
+    app.json = OrjsonProvider(app)
+
 # [SECURITY CONFIGURATION]
 app.secret_key = os.getenv('SECRET_KEY', 'rahasia_Blast_Pro_Saas_ultimate_key_v99_production_ready')
 
@@ -96,6 +156,8 @@ except ImportError as e:
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# DSN Postgres langsung (Supabase > Project Settings > Database). Opsional, khusus jalur bulk COPY.
+SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL")
 
 if not SUPABASE_URL or not SUPABASE_KEY:
     logger.critical("❌ CRITICAL ERROR: Environment Variables Missing (SUPABASE_URL / KEY).")
@@ -103,8 +165,16 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     supabase = None
 else:
     try:
-        # Inisialisasi Client Supabase
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        # Inisialisasi Client Supabase (pool koneksi PostgREST dipake bareng semua thread & worker,
+        # koneksi idle ditahan 5 menit biar query yang jarang-jarang gak handshake TLS ulang)
+        _SUPABASE_HTTP = httpx.Client(
+            http2=True,
+            timeout=120,
+            follow_redirects=True,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=300)
+        )
+        atexit.register(_SUPABASE_HTTP.close)
+        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=_SUPABASE_HTTP))
         logger.info("✅ Supabase API Connected Successfully.")
     except Exception as e:
         logger.critical(f"❌ Supabase Connection Failed: {e}")
@@ -121,15 +191,107 @@ API_HASH = os.getenv('API_HASH', '')
 if API_ID == 0 or not API_HASH:
     logger.warning("⚠️ WARNING: API_ID atau API_HASH Telegram belum disetting di Environment!")
 
-# In-Memory State Storage
-login_states = {}   # Digunakan untuk rate limiting dan tracking login
+class StateStore:
+    """
+    Key-value kecil ber-TTL buat flag runtime (stop broadcast, cooldown OTP).
+    Pake Redis kalau REDIS_URL diset (kelihatan di semua worker gunicorn),
+    fallback ke dict in-memory (1 proses) yang entry-nya ikut expired.
+    """
+    SWEEP_EVERY = 1000
+
+    def __init__(self, url=None):
+        self._redis = None
+        self._data = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+        if url and redis:
+            try:
+                self._redis = redis.Redis.from_url(url, decode_responses=True, socket_keepalive=True,
+                                                   socket_timeout=5, health_check_interval=30)
+                self._redis.ping()
+                logger.info("✅ State Store: Redis Connected.")
+            except Exception as e:
+                logger.error(f"State Store Redis Error (fallback ke memory): {e}")
+                self._redis = None
+
+    def setex(self, key, ttl, value):
+        if self._redis:
+            try:
+                self._redis.setex(key, ttl, value)
+                return
+            except Exception as e:
+                logger.error(f"State Store SET Error: {e}")
+        now = time.time()
+        with self._lock:
+            self._data[key] = (value, now + ttl)
+            self._writes += 1
+            # Sapu entry basi sesekali biar dict gak numpuk selamanya
+            if self._writes % self.SWEEP_EVERY == 0:
+                for k in [k for k, (_, exp) in self._data.items() if exp <= now]:
+                    del self._data[k]
+
+    def get(self, key):
+        if self._redis:
+            try:
+                return self._redis.get(key)
+            except Exception as e:
+                logger.error(f"State Store GET Error: {e}")
+        with self._lock:
+            hit = self._data.get(key)
+            if not hit: return None
+            if hit[1] <= time.time():
+                del self._data[key]
+                return None
+            return hit[0]
+
+    def ttl(self, key):
+        """Sisa umur key dalam detik (0 kalau gak ada / sudah expired)."""
+        if self._redis:
+            try:
+                return max(self._redis.ttl(key), 0)
+            except Exception as e:
+                logger.error(f"State Store TTL Error: {e}")
+        with self._lock:
+            hit = self._data.get(key)
+        return max(int(hit[1] - time.time()), 0) if hit else 0
+
+    def delete(self, key):
+        if self._redis:
+            try:
+                self._redis.delete(key)
+                return
+            except Exception as e:
+                logger.error(f"State Store DEL Error: {e}")
+        with self._lock:
+            self._data.pop(key, None)
+
+# Runtime State Storage
+state_store = StateStore(os.getenv("REDIS_URL"))
+OTP_COOLDOWN_SEC = 60        # Jeda minimal antar request OTP per user
+BROADCAST_STATE_TTL = 3600   # Flag broadcast ('running' / 'stopped') otomatis hilang setelah 1 jam
 qr_sessions = {}    # Storage untuk QR Login (Client Object disimpan sementara)
-broadcast_states = {} # Melacak status broadcast tiap user ('running' / 'stopped')
+
+# Kolom telegram_accounts buat listing di dashboard (session_string sengaja gak ikut ditarik, isinya blob besar)
+ACCOUNT_LIST_COLUMNS = "id, phone_number, first_name, last_name, username, is_active, created_at"
+
+def _otp_key(user_id): return f"otp:{user_id}"
+def _broadcast_key(user_id): return f"bc:{user_id}"
+
+def is_broadcast_stopped(user_id):
+    return state_store.get(_broadcast_key(user_id)) == 'stopped'
 
 # ==============================================================================
 # SECTION 4: BACKGROUND SYSTEMS (WORKERS & UTILITIES)
 # ==============================================================================
 
+# HTTP client bersama (keep-alive + HTTP/2) -> alert & heartbeat gak handshake TCP/TLS ulang tiap request
+_HTTP = httpx.Client(
+    http2=True,
+    timeout=5.0,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=40)
+)
+atexit.register(_HTTP.close)
+
 def start_self_ping():
     """
     Background Worker: Anti-Sleep Mechanism.
@@ -155,12 +317,11 @@ def start_self_ping():
                 time.sleep(840)
                 
                 # Kirim Heartbeat
-                with httpx.Client(timeout=10) as client:
-                    resp = client.get(ping_endpoint)
-                    if resp.status_code == 200:
-                        logger.info(f"💓 [Heartbeat] Server is Alive | Time: {datetime.utcnow()}")
-                    else:
-                        logger.warning(f"⚠️ [Heartbeat] Ping returned status: {resp.status_code}")
+                resp = _HTTP.get(ping_endpoint, timeout=10)
+                if resp.status_code == 200:
+                    logger.info(f"💓 [Heartbeat] Server is Alive | Time: {datetime.utcnow()}")
+                else:
+                    logger.warning(f"⚠️ [Heartbeat] Ping returned status: {resp.status_code}")
                         
             except Exception as e:
                 logger.error(f"❌ [Heartbeat] Ping Failed: {e}")
@@ -169,12 +330,22 @@ def start_self_ping():
     # Jalankan sebagai Daemon Thread
     threading.Thread(target=_worker, daemon=True, name="PingWorker").start()
 
+# Event loop di-cache per thread (1 loop dipake ulang, gak bikin & nutup loop baru tiap request)
+_loop_tls = threading.local()
+
+def _get_thread_loop():
+    loop = getattr(_loop_tls, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _loop_tls.loop = loop
+    return loop
+
 def run_async(coroutine):
     """
     Bridge Helper: Menjalankan Asyncio Coroutine di dalam Flask (Synchronous).
-    Membuat Event Loop terisolasi untuk setiap eksekusi.
+    Pake event loop milik thread ini; sisa task dibersihin (cancel + await) tapi loop-nya gak ditutup.
     """
-    loop = asyncio.new_event_loop()
+    loop = _get_thread_loop()
     asyncio.set_event_loop(loop)
     try:
         return loop.run_until_complete(coroutine)
@@ -186,16 +357,91 @@ def run_async(coroutine):
             pending = asyncio.all_tasks(loop)
             for task in pending:
                 task.cancel()
-            loop.close()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
         except:
             pass
 
+def get_json_body():
+    """
+    Body JSON request sebagai dict. Body kosong / bukan JSON / bukan object -> {}
+    (handler tinggal cek field wajib, gak 400/500 gara-gara request.json None).
+    """
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
 def allowed_file(filename):
     """Cek ekstensi file yang diizinkan untuk upload gambar"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def normalize_topic_ids(raw):
+    """
+    Rapihin topic_ids sebelum disimpan ke blast_targets -> format baku "123,456" (atau None).
+    Terima string "123, 456" maupun list [123, 456]; yang bukan angka dibuang.
+    """
+    if not raw: return None
+    parts = raw if isinstance(raw, (list, tuple)) else str(raw).split(',')
+    clean = [str(p).strip() for p in parts]
+    return ",".join(dict.fromkeys(p for p in clean if p.isdigit())) or None
+
+def parse_topic_ids(stored):
+    """Baca topic_ids dari DB (format baku hasil normalize_topic_ids) jadi list int."""
+    if not stored: return []
+    try:
+        return [int(x) for x in stored.split(',')]
+    except (ValueError, AttributeError):
+        # Data lama yang belum dirapihin
+        return [int(x) for x in (normalize_topic_ids(stored) or '').split(',') if x]
+
+# 1 item antrian kirim jadwal (1 grup x 1 topic) -> tuple ringan, bukan dict
+SendItem = namedtuple('SendItem', 'group_id topic_id group_name')
+
 # --- "Trigger BOT TELEGRAM
 
+# Pool notif: kirim alert di background biar request / event loop gak nungguin API Telegram
+_NOTIF_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="notif")
+
+# Pool query Supabase paralel buat halaman dashboard (read yang gak saling bergantung ditembak barengan)
+_DB_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="dashboard_db")
+
+# Pool insert blast_logs dari stream broadcast (dipake bareng semua broadcast -> jumlah thread tetap terbatas)
+_BLAST_LOG_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="blast")
+
+# Token bot notif dibaca sekali aja pas boot
+_NOTIF_TOKEN = os.getenv("NOTIF_BOT_TOKEN")
+
+# Cache chat_id notif per user (user_id -> (chat_id, expired_at)). Cuma yang udah connect yang di-cache,
+# jadi user yang baru connect bot langsung kebaca tanpa nunggu TTL.
+# chat_id ditulis bot.py (proses lain, gak bisa invalidate cache ini) -> TTL pendek, dan kalau Telegram
+# nolak chat-nya (4xx) entry langsung dibuang biar kiriman berikutnya baca ulang dari DB.
+NOTIF_CHAT_CACHE_TTL = 60
+NOTIF_CHAT_CACHE_MAX = 10000
+_NOTIF_CHAT_CACHE = {}
+_NOTIF_CHAT_CACHE_LOCK = threading.Lock()
+
+# Circuit breaker API Telegram: 3x gagal beruntun -> skip semua alert selama 60 detik
+NOTIF_CB_MAX_FAILS = 3
+NOTIF_CB_COOLDOWN = 60
+_NOTIF_CB = {'fails': 0, 'open_until': 0.0}
+_NOTIF_CB_LOCK = threading.Lock()
+
+def _notif_cb_record(ok):
+    """Catat hasil kirim ke API Telegram & buka breaker kalau gagal terus."""
+    with _NOTIF_CB_LOCK:
+        if ok:
+            _NOTIF_CB['fails'] = 0
+            return
+        _NOTIF_CB['fails'] += 1
+        if _NOTIF_CB['fails'] >= NOTIF_CB_MAX_FAILS:
+            _NOTIF_CB['open_until'] = time.time() + NOTIF_CB_COOLDOWN
+            _NOTIF_CB['fails'] = 0
+            logger.warning(f"⚠️ API Telegram error beruntun, notif di-skip {NOTIF_CB_COOLDOWN} detik")
+
+def invalidate_notif_chat_cache(user_id):
+    """Buang cache chat_id user. Panggil tiap kali koneksi bot notif user berubah."""
+    with _NOTIF_CHAT_CACHE_LOCK:
+        _NOTIF_CHAT_CACHE.pop(user_id, None)
+
 def send_telegram_alert(user_id, message, show_report_btn=False):
     """
     Kirim notif ke Telegram User.
@@ -206,15 +452,28 @@ def send_telegram_alert(user_id, message, show_report_btn=False):
         logger.warning(f"⚠️ Skip notif user {user_id}: Database Disconnected")
         return
 
+    if not _NOTIF_TOKEN: return
+
+    # Breaker lagi kebuka -> langsung skip, jangan makan timeout 5 detik
+    if time.time() < _NOTIF_CB['open_until']: return
+
     try:
-        res = supabase.table('users').select("notification_chat_id").eq('id', user_id).execute()
-        if not res.data or not res.data[0]['notification_chat_id']: return 
-        
-        chat_id = res.data[0]['notification_chat_id']
-        notif_token = os.getenv("NOTIF_BOT_TOKEN")
-        if not notif_token: return
+        chat_id = None
+        with _NOTIF_CHAT_CACHE_LOCK:
+            cached = _NOTIF_CHAT_CACHE.get(user_id)
+            if cached and time.time() < cached[1]:
+                chat_id = cached[0]
+
+        if chat_id is None:
+            res = supabase.table('users').select("notification_chat_id").eq('id', user_id).execute()
+            if not res.data or not res.data[0]['notification_chat_id']: return 
+
+            chat_id = res.data[0]['notification_chat_id']
+            with _NOTIF_CHAT_CACHE_LOCK:
+                if len(_NOTIF_CHAT_CACHE) >= NOTIF_CHAT_CACHE_MAX: _NOTIF_CHAT_CACHE.clear()
+                _NOTIF_CHAT_CACHE[user_id] = (chat_id, time.time() + NOTIF_CHAT_CACHE_TTL)
         
-        url = f"https://api.telegram.org/bot{notif_token}/sendMessage"
+        url = f"https://api.telegram.org/bot{_NOTIF_TOKEN}/sendMessage"
         
         payload = {
             "chat_id": chat_id,
@@ -233,7 +492,15 @@ def send_telegram_alert(user_id, message, show_report_btn=False):
                 ]]
             }
 
-        httpx.post(url, json=payload, timeout=5)
+        try:
+            resp = _HTTP.post(url, json=payload)
+        except httpx.HTTPError:
+            _notif_cb_record(False)
+            raise
+        # 5xx = masalah di sisi Telegram (4xx = salah payload/chat, bukan alasan buka breaker)
+        _notif_cb_record(resp.status_code < 500)
+        if 400 <= resp.status_code < 500:
+            invalidate_notif_chat_cache(user_id)
     except Exception as e:
         # [FIX LOGGING] Pake logger biar seragam sama yang lain
         logger.error(f"⚠️ Gagal kirim notif: {e}")
@@ -253,16 +520,34 @@ class MessageTemplateManager:
     Manajer untuk menangani CRUD Template Pesan.
     Sistem ini memungkinkan user menyimpan format pesan yang sering digunakan.
     """
+
+    # Cache template per user_id -> (list template, expired_at). Dibuang tiap create/update/delete.
+    TEMPLATES_CACHE_TTL = 60
+    _templates_cache = {}
+    _templates_lock = threading.Lock()
+
+    @staticmethod
+    def invalidate_templates(user_id):
+        with MessageTemplateManager._templates_lock:
+            MessageTemplateManager._templates_cache.pop(user_id, None)
     
     @staticmethod
     def get_templates(user_id):
         """Mengambil semua template milik user tertentu."""
         if not supabase: return []
+        with MessageTemplateManager._templates_lock:
+            cached = MessageTemplateManager._templates_cache.get(user_id)
+            if cached and time.time() < cached[1]:
+                # Copy per item biar route gak sengaja ngubah isi cache
+                return [dict(t) for t in cached[0]]
         try:
             # Mengambil dari tabel 'message_templates'
             # Pastikan table ini dibuat di Supabase (lihat instruksi SQL di dokumentasi)
             res = supabase.table('message_templates').select("*").eq('user_id', user_id).order('created_at', desc=True).execute()
-            return res.data if res.data else []
+            templates = res.data if res.data else []
+            with MessageTemplateManager._templates_lock:
+                MessageTemplateManager._templates_cache[user_id] = (templates, time.time() + MessageTemplateManager.TEMPLATES_CACHE_TTL)
+            return [dict(t) for t in templates]
         except Exception as e:
             logger.error(f"Template Fetch Error: {e}")
             return []
@@ -291,6 +576,7 @@ class MessageTemplateManager:
                 'created_at': datetime.utcnow().isoformat()
             }
             supabase.table('message_templates').insert(data).execute()
+            MessageTemplateManager.invalidate_templates(user_id)
             return True
         except Exception as e:
             logger.error(f"Template Create Error: {e}")
@@ -316,14 +602,20 @@ class MessageTemplateManager:
             # 3. CEK PENGGUNAAN (Safety Check Level 1)
             # Cek apakah template lagi dipake di jadwal aktif?
             try:
-                usage_check = supabase.table('blast_schedules')\
-                    .select("run_hour, run_minute")\
+                # HEAD + count dulu (gak narik body), detail jam baru diambil kalau emang kepake
+                usage_count = supabase.table('blast_schedules')\
+                    .select("id", count='exact', head=True)\
                     .eq('template_id', t_id)\
                     .eq('is_active', True)\
                     .execute()
                 
                 # Kalau ketemu jadwal yang pake template ini -> TOLAK HAPUS
-                if usage_check.data and len(usage_check.data) > 0:
+                if usage_count.count:
+                    usage_check = supabase.table('blast_schedules')\
+                        .select("run_hour, run_minute")\
+                        .eq('template_id', t_id)\
+                        .eq('is_active', True)\
+                        .execute()
                     times = [f"{s['run_hour']:02d}:{s['run_minute']:02d}" for s in usage_check.data]
                     time_str = ", ".join(times)
                     return False, f"⚠️ Gagal Hapus! Template ini sedang AKTIF digunakan pada Jadwal Pukul: {time_str} WIB. Harap hapus atau ganti jadwalnya terlebih dahulu."
@@ -340,6 +632,7 @@ class MessageTemplateManager:
             
             # 5. VERIFIKASI HASIL
             if res.data and len(res.data) > 0:
+                MessageTemplateManager.invalidate_templates(user_id)
                 return True, "✅ Template berhasil dihapus permanen."
             else:
                 return False, "❌ Template tidak ditemukan atau sudah dihapus."
@@ -359,23 +652,55 @@ class MessageTemplateManager:
 # SECTION 4.5.5: AUTO REPLY & KEYWORD ENGINE (NEW FEATURE)
 # ==============================================================================
 
+# Karakter pemisah yang dibuang dari nomor HP (1x pass str.translate)
+_PHONE_STRIP = str.maketrans('', '', ' -')
+
 class AutoReplyManager:
     """
     Mengelola Data Pengaturan Auto Reply & Keyword Rules dari Database.
     Fokus pada CRUD dan Logika Data.
     """
 
+    # Cache settingan per (user_id, target_phone) -> (data, expired_at)
+    SETTINGS_CACHE_TTL = 60
+    _settings_cache = {}
+    _settings_lock = threading.Lock()
+
+    # Cache keyword per user_id -> (rules urut terbaru, expired_at)
+    KEYWORDS_CACHE_TTL = 30
+    _keywords_cache = {}
+    _keywords_lock = threading.Lock()
+
+    @staticmethod
+    def invalidate_keywords(user_id):
+        with AutoReplyManager._keywords_lock:
+            AutoReplyManager._keywords_cache.pop(user_id, None)
+
+    @staticmethod
+    def peek_cached(cache, lock, key):
+        """Ambil isi cache TTL tanpa nyentuh DB. None kalau belum ada / udah basi."""
+        with lock:
+            cached = cache.get(key)
+            if cached and time.time() < cached[1]:
+                return cached[0]
+        return None
+
+    @staticmethod
+    def invalidate_settings(user_id):
+        """Buang semua cache settingan user (perubahan 'all' ngaruh ke semua nomor)."""
+        with AutoReplyManager._settings_lock:
+            for key in [k for k in AutoReplyManager._settings_cache if k[0] == user_id]:
+                del AutoReplyManager._settings_cache[key]
+
     @staticmethod
     def normalize_phone(phone):
         """
         Membersihkan format nomor HP agar konsisten (+62812...)
         Hapus spasi, strip, dan pastikan ada tanda plus.
         """
-        if not phone: return 'all'
-        if phone == 'all': return 'all'
-        clean = str(phone).replace(" ", "").replace("-", "").strip()
-        if not clean.startswith("+"): clean = "+" + clean
-        return clean
+        if not phone or phone == 'all': return 'all'
+        clean = str(phone).translate(_PHONE_STRIP).strip()
+        return clean if clean.startswith("+") else "+" + clean
 
     @staticmethod
     def get_settings(user_id, raw_target='all'):
@@ -389,29 +714,28 @@ class AutoReplyManager:
         target = AutoReplyManager.normalize_phone(raw_target)
         
         if not supabase: return None
+
+        cache_key = (user_id, target)
+        cached = AutoReplyManager.peek_cached(AutoReplyManager._settings_cache, AutoReplyManager._settings_lock, cache_key)
+        if cached is not None: return dict(cached)
         
-        # 1. Coba cari settingan spesifik
+        # 1 query buat spesifik + global sekaligus, prioritas dipilih di Python
         res = supabase.table('auto_reply_settings').select("*")\
-            .eq('user_id', user_id).eq('target_phone', target).execute()
+            .eq('user_id', user_id).in_('target_phone', list({target, 'all'})).execute()
+        rows = {r['target_phone']: r for r in (res.data or [])}
         
-        if res.data:
-            return res.data[0]
-            
-        # 2. Fallback ke Global ('all') jika yang dicari bukan 'all'
-        if target != 'all':
-            res_glob = supabase.table('auto_reply_settings').select("*")\
-                .eq('user_id', user_id).eq('target_phone', 'all').execute()
-            if res_glob.data:
-                return res_glob.data[0]
-
-        # 3. Default (Fitur Dianggap Mati)
-        return {
+        # 1. Settingan spesifik -> 2. Fallback ke Global ('all') -> 3. Default (Fitur Dianggap Mati)
+        result = rows.get(target) or rows.get('all') or {
             'is_active': False, 
             'cooldown_minutes': 60, 
             'welcome_message': '', 
             'target_phone': target
         }
 
+        with AutoReplyManager._settings_lock:
+            AutoReplyManager._settings_cache[cache_key] = (result, time.time() + AutoReplyManager.SETTINGS_CACHE_TTL)
+        return dict(result)
+
     @staticmethod
     def update_settings(user_id, data):
         """
@@ -419,26 +743,33 @@ class AutoReplyManager:
         """
         # Normalize dulu target-nya biar gak double
         data['target_phone'] = AutoReplyManager.normalize_phone(data.get('target_phone', 'all'))
+        data['user_id'] = user_id
         
-        # Cek existing
-        existing = supabase.table('auto_reply_settings').select("id")\
-            .eq('user_id', user_id).eq('target_phone', data['target_phone']).execute()
-            
-        if existing.data:
-            # Update
-            supabase.table('auto_reply_settings').update(data)\
-                .eq('id', existing.data[0]['id']).execute()
-        else:
-            # Insert
-            data['user_id'] = user_id
-            supabase.table('auto_reply_settings').insert(data).execute()
+        # 1x INSERT ... ON CONFLICT (butuh unique index, lihat sql/auto_reply_settings_unique.sql)
+        supabase.table('auto_reply_settings').upsert(data, on_conflict="user_id, target_phone").execute()
+
+        AutoReplyManager.invalidate_settings(user_id)
+        AutoReplyService.request_reconcile()
 
     @staticmethod
     def get_keywords(user_id):
-        """Ambil semua keyword milik user ini."""
-        res = supabase.table('keyword_rules').select("*")\
-            .eq('user_id', user_id).order('created_at', desc=True).execute()
-        return res.data if res.data else []
+        """Ambil semua keyword milik user ini (terbaru duluan)."""
+        cached = AutoReplyManager.peek_cached(AutoReplyManager._keywords_cache, AutoReplyManager._keywords_lock, user_id)
+        if cached is not None: return list(cached)
+
+        # Tanpa ORDER BY di DB, datanya kecil -> diurutin di Python
+        res = supabase.table('keyword_rules').select("*").eq('user_id', user_id).execute()
+        rules = sorted(res.data or [], key=lambda r: r.get('created_at') or '', reverse=True)
+        # Target nomor & keyword dinormalisasi sekali pas load ke field privat (_norm_target/_kw),
+        # 'keyword' asli gak diubah biar dashboard tetap nampilin & nyimpen teks apa adanya
+        # (add_keyword udah lowercase, tapi data lama / edit manual di DB bisa masih campur huruf besar)
+        for r in rules:
+            r['_norm_target'] = AutoReplyManager.normalize_phone(r.get('target_phone'))
+            r['_kw'] = str(r.get('keyword') or '').lower().strip()
+
+        with AutoReplyManager._keywords_lock:
+            AutoReplyManager._keywords_cache[user_id] = (rules, time.time() + AutoReplyManager.KEYWORDS_CACHE_TTL)
+        return list(rules)
 
     @staticmethod
     def add_keyword(user_id, keyword, response, raw_target='all'):
@@ -451,11 +782,78 @@ class AutoReplyManager:
             'target_phone': target
         }
         supabase.table('keyword_rules').insert(data).execute()
+        AutoReplyManager.invalidate_keywords(user_id)
 
     @staticmethod
     def delete_keyword(id):
         """Hapus keyword berdasarkan ID."""
-        supabase.table('keyword_rules').delete().eq('id', id).execute()
+        res = supabase.table('keyword_rules').delete().eq('id', id).execute()
+        for row in (res.data or []):
+            AutoReplyManager.invalidate_keywords(row.get('user_id'))
+
+class KeywordMatcher:
+    """
+    Pencocok keyword auto-reply yang dibangun sekali per listener.
+    rules harus udah urut prioritas (Spesifik dulu, baru Global) -> match() balikin rule
+    dengan prioritas tertinggi yang keyword-nya muncul di teks (partial match).
+    """
+    def __init__(self, rules, split_commas=False):
+        self.rules = rules
+        self._automaton = None
+        # (keyword lowercase, index rule) disiapin sekali -> handler gak perlu .lower()/.get() per pesan
+        # split_commas: 1 rule boleh punya banyak trigger, contoh "halo, hai, pagi kak"
+        self._pairs = []
+        for idx, r in enumerate(rules):
+            raw = r.get('_kw')
+            if raw is None: raw = str(r.get('keyword') or '').lower()
+            for kw in (raw.split(',') if split_commas else (raw,)):
+                self._pairs.append((kw.lower().strip(), idx))
+
+        self._pattern = None
+        # Keyword dobel -> yang prioritasnya lebih tinggi (index kecil) yang dipake
+        first_idx = {}
+        for kw, idx in self._pairs:
+            if kw: first_idx.setdefault(kw, idx)
+        if not first_idx: return
+
+        if ahocorasick:
+            self._automaton = ahocorasick.Automaton()
+            for kw, idx in first_idx.items():
+                self._automaton.add_word(kw, idx)
+            self._automaton.make_automaton()
+        else:
+            # Fallback tanpa pyahocorasick: 1 regex gabungan (urut prioritas) di-scan sekali di C.
+            # Pake lookahead biar match yang tumpang tindih tetep kebaca semua.
+            self._kw_index = first_idx
+            self._pattern = re.compile('(?=(' + '|'.join(re.escape(kw) for kw in first_idx) + '))')
+
+    def match(self, text):
+        if self._pattern is not None:
+            best = None
+            for m in self._pattern.finditer(text):
+                idx = self._kw_index[m.group(1)]
+                if best is None or idx < best:
+                    best = idx
+                    if best == 0: break
+            return self.rules[best] if best is not None else None
+
+        if self._automaton is None: return None
+
+        best = None
+        for _, idx in self._automaton.iter(text):
+            if best is None or idx < best:
+                best = idx
+                if best == 0: break
+        return self.rules[best] if best is not None else None
+
+def is_private_incoming(event):
+    """
+    Filter event auto-reply: cuma chat pribadi (PeerUser) yang bukan kiriman via bot.
+    Dipasang di events.NewMessage(func=...) -> pesan grup/channel dibuang Telethon
+    sebelum coroutine handler dibikin.
+    """
+    msg = event.message
+    return not msg.via_bot_id and type(msg.peer_id) is types.PeerUser
 
 class ReplyEngine:
     """
@@ -464,6 +862,26 @@ class ReplyEngine:
     """
     active_listeners = {} 
 
+    # Cache cooldown (dipake handler Satpam): (user_id, sender_id) -> epoch balasan terakhir. LRU di RAM, tabel reply_logs cuma backup.
+    COOLDOWN_CACHE_MAX = 100000
+    _cooldown_cache = OrderedDict()
+    _cooldown_lock = threading.Lock()
+
+    @staticmethod
+    def _get_last_reply(key):
+        with ReplyEngine._cooldown_lock:
+            ts = ReplyEngine._cooldown_cache.get(key)
+            if ts is not None: ReplyEngine._cooldown_cache.move_to_end(key)
+            return ts
+
+    @staticmethod
+    def _remember_reply(key, ts):
+        with ReplyEngine._cooldown_lock:
+            ReplyEngine._cooldown_cache[key] = ts
+            ReplyEngine._cooldown_cache.move_to_end(key)
+            if len(ReplyEngine._cooldown_cache) > ReplyEngine.COOLDOWN_CACHE_MAX:
+                ReplyEngine._cooldown_cache.popitem(last=False)
+
     @staticmethod
     def start_listener(user_id, client):
         client_key = f"{user_id}_{id(client)}"
@@ -568,6 +986,120 @@ class SchedulerWorker:
     last_run_minute = None
     _exec_guard_lock = threading.Lock()
     _executed_run_keys = {}
+
+    # Index jadwal aktif di RAM: (jam, menit) -> [jadwal]. Tick per menit cukup lookup dict,
+    # DB cuma dibaca ulang tiap SCHEDULE_INDEX_TTL detik atau pas ada jadwal yang diubah.
+    SCHEDULE_INDEX_TTL = 300
+    _index = {}
+    _index_exp = 0
+    _index_lock = threading.Lock()
+
+    # Event loop khusus eksekusi task (1 thread awet) -> TelegramClient bisa dipake ulang antar task
+    CLIENT_IDLE_TIMEOUT = 1800
+    _task_loop = None
+    _task_loop_lock = threading.Lock()
+    _clients = {} # { (user_id, phone): {'client', 'session', 'last_used', 'in_use'} }
+
+    @staticmethod
+    def _get_task_loop():
+        with SchedulerWorker._task_loop_lock:
+            if SchedulerWorker._task_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True, name="SchedulerTaskLoop").start()
+                asyncio.run_coroutine_threadsafe(SchedulerWorker._evict_idle_clients(), loop)
+                SchedulerWorker._task_loop = loop
+            return SchedulerWorker._task_loop
+
+    @staticmethod
+    async def _acquire_client(user_id, phone, session_string):
+        """Ambil client yang udah konek buat akun ini, bikin baru kalau belum ada / sesi berubah / putus."""
+        key = (user_id, phone)
+        entry = SchedulerWorker._clients.get(key)
+        if entry and (entry['session'] != session_string or not entry['client'].is_connected()):
+            SchedulerWorker._clients.pop(key, None)
+            try: await entry['client'].disconnect()
+            except: pass
+            entry = None
+
+        if not entry:
+            # [UPGRADE ANTI-CRASH] Tambahkan sequential_updates=True
+            client = TelegramClient(StringSession(session_string), API_ID, API_HASH, sequential_updates=True)
+            await client.connect()
+            entry = {'client': client, 'session': session_string, 'in_use': 0}
+            SchedulerWorker._clients[key] = entry
+
+        # in_use = jumlah task yang lagi megang client ini -> gak boleh diputus sweeper walau blast-nya lama
+        entry['in_use'] += 1
+        entry['last_used'] = time.time()
+        return entry['client']
+
+    @staticmethod
+    def _release_client(user_id, phone, client):
+        """Task selesai pake client -> kurangi in_use & mulai hitung nganggur dari sekarang."""
+        entry = SchedulerWorker._clients.get((user_id, phone))
+        if entry and entry['client'] is client:
+            entry['in_use'] = max(0, entry['in_use'] - 1)
+            entry['last_used'] = time.time()
+
+    @staticmethod
+    async def _drop_client(user_id, phone):
+        entry = SchedulerWorker._clients.pop((user_id, phone), None)
+        if entry:
+            try: await entry['client'].disconnect()
+            except: pass
+
+    @staticmethod
+    async def _evict_idle_clients():
+        """Putusin client yang nganggur > CLIENT_IDLE_TIMEOUT (dicek tiap 5 menit). Yang lagi dipake task dilewatin."""
+        while True:
+            await asyncio.sleep(300)
+            now_ts = time.time()
+            for key, entry in list(SchedulerWorker._clients.items()):
+                if entry['in_use'] == 0 and now_ts - entry['last_used'] > SchedulerWorker.CLIENT_IDLE_TIMEOUT:
+                    await SchedulerWorker._drop_client(*key)
+
+    # Min-heap waktu bangun berikutnya (jadwal jalan + pengingat 5 menit), dibangun ulang tiap index berubah
+    _fire_heap = []
+    _heap_index = None
+    _wake = threading.Event()
+
+    @staticmethod
+    def invalidate_index():
+        """Paksa index jadwal dibaca ulang di tick berikutnya. Panggil tiap add/edit/hapus jadwal."""
+        with SchedulerWorker._index_lock:
+            SchedulerWorker._index_exp = 0
+        # Bangunin loop biar jadwal baru langsung masuk hitungan
+        SchedulerWorker._wake.set()
+
+    @staticmethod
+    def _build_fire_heap(index, now_indo):
+        """Semua (jam, menit) di index -> waktu eksekusi & pengingat berikutnya dalam 24 jam ke depan."""
+        base = now_indo.replace(second=0, microsecond=0)
+        heap = []
+        for (h, m) in index:
+            run_at = base.replace(hour=h, minute=m)
+            for fire in (run_at, run_at - timedelta(minutes=5)):
+                while fire <= base: fire += timedelta(days=1)
+                while fire > base + timedelta(days=1): fire -= timedelta(days=1)
+                heap.append(fire)
+        heapq.heapify(heap)
+        return heap
+
+    @staticmethod
+    def _get_index():
+        with SchedulerWorker._index_lock:
+            if time.time() < SchedulerWorker._index_exp:
+                return SchedulerWorker._index
+
+        rows = supabase.table('blast_schedules').select("*").eq('is_active', True).execute().data or []
+        index = {}
+        for row in rows:
+            index.setdefault((row['run_hour'], row['run_minute']), []).append(row)
+
+        with SchedulerWorker._index_lock:
+            SchedulerWorker._index = index
+            SchedulerWorker._index_exp = time.time() + SchedulerWorker.SCHEDULE_INDEX_TTL
+        return index
     
     @staticmethod
     def start():
@@ -576,24 +1108,37 @@ class SchedulerWorker:
 
     @staticmethod
     def _loop():
-        """Main Loop: Cek setiap detik ke-00"""
+        """Main Loop: tidur sampai jadwal/pengingat berikutnya (atau index perlu di-refresh), bukan tiap menit"""
+        tz_indo = pytz.timezone('Asia/Jakarta')
         while True:
             try:
                 # 1. Ambil Waktu Sekarang (WIB)
-                tz_indo = pytz.timezone('Asia/Jakarta')
                 now_indo = datetime.now(tz_indo)
+                minute_key = now_indo.strftime('%Y%m%d%H%M')
 
                 # [UPGRADE] Cek agar tidak memproses jadwal 2x di menit yang persis sama
-                if SchedulerWorker.last_run_minute != now_indo.minute:
-                    # 2. Cek Jadwal di DB
-                    if supabase:
-                        SchedulerWorker._process_schedules(now_indo)
-                    SchedulerWorker.last_run_minute = now_indo.minute
-                
-                # 3. Sleep Pintar (Sync ke detik 00)
-                sleep_time = 60 - datetime.now().second
-                if sleep_time < 0: sleep_time = 1
-                time.sleep(sleep_time)
+                if SchedulerWorker.last_run_minute != minute_key:
+                    # 2. Cek Jadwal (lookup index di RAM, DB cuma kalau ada yang jatuh tempo)
+                    SchedulerWorker._process_schedules(now_indo)
+                    SchedulerWorker.last_run_minute = minute_key
+
+                # 3. Sleep Pintar: bangun pas waktu paling awal di heap / pas index expired
+                index = SchedulerWorker._get_index()
+                if SchedulerWorker._heap_index is not index:
+                    SchedulerWorker._fire_heap = SchedulerWorker._build_fire_heap(index, now_indo)
+                    SchedulerWorker._heap_index = index
+
+                heap = SchedulerWorker._fire_heap
+                base = now_indo.replace(second=0, microsecond=0)
+                while heap and heap[0] <= base:
+                    # Udah lewat -> jadwal harian, masukin lagi buat besok
+                    heapq.heapreplace(heap, heap[0] + timedelta(days=1))
+
+                wake_at = SchedulerWorker._index_exp
+                if heap: wake_at = min(wake_at, heap[0].timestamp())
+
+                SchedulerWorker._wake.wait(max(1, wake_at - time.time()))
+                SchedulerWorker._wake.clear()
                 
             except Exception as e:
                 logger.error(f"Scheduler Loop Error: {e}")
@@ -607,12 +1152,10 @@ class SchedulerWorker:
             f_hour = future_time.hour
             f_minute = future_time.minute
             
+            index = SchedulerWorker._get_index()
+
             # Cek jadwal 5 menit ke depan
-            upcoming = supabase.table('blast_schedules').select("user_id")\
-                .eq('is_active', True)\
-                .eq('run_hour', f_hour)\
-                .eq('run_minute', f_minute)\
-                .execute().data
+            upcoming = index.get((f_hour, f_minute), [])
                 
             for job in upcoming:
                 msg = (
@@ -621,14 +1164,18 @@ class SchedulerWorker:
                     f"(Pukul {f_hour}:{f_minute:02d} WIB).\n\n"
                     "Pastikan akun Telegram pengirim (Sender) Anda aktif/online agar proses lancar."
                 )
-                threading.Thread(target=send_telegram_alert, args=(job['user_id'], msg)).start()
+                _NOTIF_POOL.submit(send_telegram_alert, job['user_id'], msg)
             
             # --- 2. EKSEKUSI JADWAL SEKARANG (INI YANG KEMAREN ILANG) ---
             current_hour = current_time_indo.hour
             current_minute = current_time_indo.minute
 
-            # [FIX UTAMA] Definisikan variabel 'res' disini!
+            due = index.get((current_hour, current_minute))
+            if not due: return
+
+            # Ada yang jatuh tempo -> ambil data terbaru by ID (jaga-jaga jadwal udah diedit/dihapus dari proses lain)
             res = supabase.table('blast_schedules').select("*")\
+                .in_('id', [t['id'] for t in due])\
                 .eq('is_active', True)\
                 .eq('run_hour', current_hour)\
                 .eq('run_minute', current_minute)\
@@ -685,12 +1232,16 @@ class SchedulerWorker:
         # [UPGRADE ANTI-HALO] Kalau ternyata pesan masih bawaan "Halo" dan template kosong, BATALKAN!
         if message_content == "Halo! Ini pesan terjadwal otomatis." and not template_id:
             logger.error(f"Task Batal: Template kosong/manual untuk User {user_id}")
-            send_telegram_alert(user_id, "❌ **Jadwal Dibatalkan!**\nTemplate Pesan tidak valid (Mode Manual). Harap edit jadwal dan pilih Template yang benar.")
+            _NOTIF_POOL.submit(send_telegram_alert, user_id, "❌ **Jadwal Dibatalkan!**\nTemplate Pesan tidak valid (Mode Manual). Harap edit jadwal dan pilih Template yang benar.")
             return
 
+        # Template dipecah sekali di placeholder {name} -> per grup tinggal join (tanpa placeholder = teks apa adanya)
+        msg_parts = message_content.split("{name}")
+
         # 2. Worker Async Utama
         async def _async_send():
             client = None
+            client_phone = None
             conn_error = None
             
             # --- A. LOGIC KONEKSI "STRICT" ---
@@ -700,13 +1251,15 @@ class SchedulerWorker:
 
                 if is_specific_sender:
                     # KASUS 1: USER MILIH AKUN SPESIFIK
-                    res = supabase.table('telegram_accounts').select("session_string")\
-                        .eq('user_id', user_id).eq('phone_number', sender_phone).eq('is_active', True).execute()
+                    # (Loop task dipake bareng semua jadwal -> query DB dilempar ke thread biar gak nahan task lain)
+                    res = await asyncio.to_thread(
+                        lambda: supabase.table('telegram_accounts').select("session_string")
+                            .eq('user_id', user_id).eq('phone_number', sender_phone).eq('is_active', True).execute()
+                    )
                     
                     if res.data:
-                        # [UPGRADE ANTI-CRASH] Tambahkan sequential_updates=True
-                        client = TelegramClient(StringSession(res.data[0]['session_string']), API_ID, API_HASH, sequential_updates=True)
-                        await client.connect()
+                        client_phone = sender_phone
+                        client = await SchedulerWorker._acquire_client(user_id, client_phone, res.data[0]['session_string'])
                     else:
                         # JIKA AKUN SPESIFIK MATI -> LANGSUNG STOP
                         conn_error = f"⛔ Akun {sender_phone} mati/logout. Task dibatalkan demi keamanan branding."
@@ -714,27 +1267,29 @@ class SchedulerWorker:
                 else:
                     # KASUS 2: USER MILIH "AUTO"
                     # [UPGRADE ANTI-TABRAKAN] Tembak database langsung biar gak bentrok sama get_active_client() milik AutoReply
-                    res_auto = supabase.table('telegram_accounts').select("session_string, phone_number")\
-                        .eq('user_id', user_id).eq('is_active', True).execute()
+                    res_auto = await asyncio.to_thread(
+                        lambda: supabase.table('telegram_accounts').select("session_string, phone_number")
+                            .eq('user_id', user_id).eq('is_active', True).execute()
+                    )
                         
                     if res_auto.data:
-                        client = TelegramClient(StringSession(res_auto.data[0]['session_string']), API_ID, API_HASH, sequential_updates=True)
-                        await client.connect()
+                        client_phone = res_auto.data[0]['phone_number']
+                        client = await SchedulerWorker._acquire_client(user_id, client_phone, res_auto.data[0]['session_string'])
                     else:
                         conn_error = "Tidak ada akun Telegram yang aktif sama sekali."
                 
                 # JIKA GAGAL KONEK
                 if not client or not await client.is_user_authorized():
                     # Catat Log Gagal
-                    supabase.table('blast_logs').insert({
+                    await asyncio.to_thread(lambda: supabase.table('blast_logs').insert({
                         "user_id": user_id, "group_name": "SYSTEM", "group_id": 0,
                         "status": "FAILED", "error_message": conn_error or "Auth Failed",
                         "created_at": datetime.utcnow().isoformat()
-                    }).execute()
+                    }).execute())
                     
                     # Lapor Bot
-                    send_telegram_alert(user_id, f"❌ **Jadwal Gagal!**\n{conn_error}")
-                    if client: await client.disconnect()
+                    _NOTIF_POOL.submit(send_telegram_alert, user_id, f"❌ **Jadwal Gagal!**\n{conn_error}")
+                    if client: await SchedulerWorker._drop_client(user_id, client_phone)
                     return 
 
             except Exception as e:
@@ -743,7 +1298,7 @@ class SchedulerWorker:
 
             try:
                 # --- B. PERSIAPAN DATA ---
-                send_telegram_alert(user_id, f"🚀 **Jadwal Dimulai!**\nPengirim: {sender_phone if is_specific_sender else 'Auto'}")
+                _NOTIF_POOL.submit(send_telegram_alert, user_id, f"🚀 **Jadwal Dimulai!**\nPengirim: {sender_phone if is_specific_sender else 'Auto'}")
 
                 # [UPGRADE] Load Original Message Kasta Dewa (Biar Emoji Premium Gak Rusak)
                 src_msg_obj = None
@@ -760,35 +1315,49 @@ class SchedulerWorker:
                 elif target_group_id: 
                     targets_query = targets_query.eq('id', target_group_id)
                     
-                raw_targets = targets_query.execute().data
+                raw_targets = (await asyncio.to_thread(targets_query.execute)).data
                 
                 if not raw_targets:
-                    send_telegram_alert(user_id, "⚠️ Target grup kosong.")
+                    _NOTIF_POOL.submit(send_telegram_alert, user_id, "⚠️ Target grup kosong.")
                     return
 
                 # FLATTEN TARGETS
-                send_queue = []
-                for tg in raw_targets:
-                    topic_ids = []
-                    if tg.get('topic_ids'):
-                        try: topic_ids = [int(x.strip()) for x in str(tg['topic_ids']).split(',') if x.strip().isdigit()]
-                        except: pass
-                    
-                    destinations = topic_ids if topic_ids else [None]
-                    for top_id in destinations:
-                        send_queue.append({
-                            'group_id': int(tg['group_id']),
-                            'topic_id': top_id,
-                            'group_name': tg.get('group_name', 'Unknown')
-                        })
+                send_queue = [
+                    SendItem(int(tg['group_id']), top_id, tg.get('group_name', 'Unknown'))
+                    for tg in raw_targets
+                    for top_id in (parse_topic_ids(tg.get('topic_ids')) or [None])
+                ]
 
                 # --- C. PROCESS QUEUE ---
+                # Entity grup di-resolve sekali (batch), dipake ulang buat semua topic & fase retry
+                entity_cache = {}
+                unique_gids = list({item.group_id for item in send_queue})
+                try:
+                    for gid, ent in zip(unique_gids, await client.get_entity(unique_gids)):
+                        entity_cache[gid] = ent
+                except Exception as e:
+                    # Ada 1 grup yang gagal -> sisanya di-resolve satu-satu di loop (error per grup tetap kecatat)
+                    logger.warning(f"Batch resolve entity gagal, fallback per grup: {e}")
+
                 async def process_queue(queue_list, attempt_phase):
                     next_retry_queue = []
                     success_count = 0
                     processed_since_break = 0
                     break_after = random.randint(20, 25)
+                    # Log dikumpulin dulu, di-insert sekaligus (multi-row) tiap 50 baris & di akhir putaran
+                    log_rows = []
+
+                    async def flush_logs():
+                        if not log_rows: return
+                        batch = log_rows[:]
+                        log_rows.clear()
+                        try:
+                            await asyncio.to_thread(lambda: supabase.table('blast_logs').insert(batch).execute())
+                        except Exception as log_e:
+                            logger.error(f"Scheduler Log Flush Error: {log_e}")
                     
+                    # Kirim 1-1 per akun (serial): jeda & istirahat di bawah ini yang jaga akun dari FloodWait/ban.
+                    # Paralelnya cuma antar jadwal/akun (tiap task jalan barengan di loop task).
                     for idx, item in enumerate(queue_list):
                         if processed_since_break >= break_after:
                             rest_seconds = random.randint(120, 300)
@@ -797,7 +1366,10 @@ class SchedulerWorker:
                             break_after = random.randint(20, 25)
 
                         try:
-                            entity = await client.get_entity(item['group_id'])
+                            entity = entity_cache.get(item.group_id)
+                            if entity is None:
+                                entity = await client.get_entity(item.group_id)
+                                entity_cache[item.group_id] = entity
                             await client.send_read_acknowledge(entity)
                             
                             try:
@@ -808,16 +1380,16 @@ class SchedulerWorker:
                             # [INI KUNCINYA] Eksekusi Kirim (Pilih Mode Clone atau Mode Manual)
                             if src_msg_obj:
                                 # Kirim pesan UTUH (Format, Link, Emoji Premium aman 100%)
-                                await client.send_message(entity, src_msg_obj, reply_to=item['topic_id'])
+                                await client.send_message(entity, src_msg_obj, reply_to=item.topic_id)
                             else:
                                 # Mode Manual
-                                final_msg = message_content.replace("{name}", item['group_name'])
-                                await client.send_message(entity, final_msg, reply_to=item['topic_id'])
+                                final_msg = item.group_name.join(msg_parts) if len(msg_parts) > 1 else message_content
+                                await client.send_message(entity, final_msg, reply_to=item.topic_id)
                             
-                            supabase.table('blast_logs').insert({
-                                "user_id": user_id, "group_name": item['group_name'], "group_id": str(item['group_id']), 
-                                "status": "SUCCESS", "created_at": datetime.utcnow().isoformat()
-                            }).execute()
+                            log_rows.append({
+                                "user_id": user_id, "group_name": item.group_name, "group_id": str(item.group_id), 
+                                "status": "SUCCESS", "error_message": None, "created_at": datetime.utcnow().isoformat()
+                            })
                             success_count += 1
                             processed_since_break += 1
                             
@@ -827,13 +1399,16 @@ class SchedulerWorker:
                             err = str(e)
                             if "FloodWait" in err or "SlowMode" in err: next_retry_queue.append(item)
                             else:
-                                supabase.table('blast_logs').insert({
-                                    "user_id": user_id, "group_name": item['group_name'], "status": "FAILED", 
+                                log_rows.append({
+                                    "user_id": user_id, "group_name": item.group_name, "group_id": str(item.group_id), "status": "FAILED", 
                                     "error_message": err, "created_at": datetime.utcnow().isoformat()
-                                }).execute()
+                                })
                             processed_since_break += 1
                             await asyncio.sleep(2)
 
+                        if len(log_rows) >= 50: await flush_logs()
+
+                    await flush_logs()
                     return next_retry_queue, success_count
                 
                 # --- D. EKSEKUSI ---
@@ -851,12 +1426,13 @@ class SchedulerWorker:
                         _, s3 = await process_queue(retry_2, 3)
                         total_success += s3
 
-                send_telegram_alert(user_id, f"✅ **Jadwal Selesai!**\nTotal Terkirim: {total_success}")
+                _NOTIF_POOL.submit(send_telegram_alert, user_id, f"✅ **Jadwal Selesai!**\nTotal Terkirim: {total_success}")
 
             finally: 
-                if client: await client.disconnect()
+                # Client gak di-disconnect, disimpen buat task berikutnya (diputus otomatis kalau nganggur)
+                if client: SchedulerWorker._release_client(user_id, client_phone, client)
         
-        run_async(_async_send())
+        asyncio.run_coroutine_threadsafe(_async_send(), SchedulerWorker._get_task_loop()).result()
 
 # Jalankan Scheduler saat app start
 if supabase:
@@ -873,6 +1449,68 @@ class AutoReplyService:
     """
     _loop = None
     _clients = {} # Database koneksi aktif di memori: { 'UserID_NoHP': ClientObject }
+    _matchers = {} # (user_id, no_hp) -> (list keyword sumber, KeywordMatcher), dibangun ulang kalau cache keyword ganti
+    _log_queue = None # asyncio.Queue row reply_logs, di-upsert per batch sama _reply_log_flusher
+    REPLY_LOG_BATCH = 100
+    REPLY_LOG_FLUSH_SEC = 2
+    # Patroli dibangunin langsung pas akun / settingan berubah (request_reconcile),
+    # sisanya rekonsiliasi pengaman tiap RECONCILE_INTERVAL detik
+    RECONCILE_INTERVAL = 300
+    START_CONCURRENCY = 10 # maks client yang konek barengan pas patroli
+    _reconcile_event = None
+
+    @classmethod
+    def request_reconcile(cls):
+        """Minta Satpam cek ulang akun sekarang juga (aman dipanggil dari thread mana aja)."""
+        if cls._loop and cls._reconcile_event:
+            cls._loop.call_soon_threadsafe(cls._reconcile_event.set)
+
+    @classmethod
+    def _get_matcher(cls, user_id, my_phone, keywords):
+        entry = cls._matchers.get((user_id, my_phone))
+        if entry and entry[0] is keywords: return entry[1]
+        # Prioritas: 
+        # 1. Keyword yang TARGETNYA == NOMOR INI, 2. Keyword yang TARGETNYA == ALL
+        # (Specific duluan biar menang)
+        matcher = KeywordMatcher(
+            [r for r in keywords if r.get('_norm_target') == my_phone] +
+            [r for r in keywords if r.get('target_phone') == 'all'],
+            split_commas=True
+        )
+        cls._matchers[(user_id, my_phone)] = (keywords, matcher)
+        return matcher
+
+    @classmethod
+    def run(cls, coroutine, timeout=60):
+        """
+        Jalanin coroutine dari thread Flask di loop Satpam (1 loop long-lived, client-nya bisa dipinjem).
+        Kalau Satpam belum nyala, fallback ke run_async biasa.
+        Lewat timeout -> coroutine-nya dibatalin & FutureTimeoutError dilempar ke route pemanggil.
+        """
+        if cls._loop and cls._loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(coroutine, cls._loop)
+            try:
+                return future.result(timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                raise
+        return run_async(coroutine)
+
+    @classmethod
+    def submit(cls, coroutine):
+        """Titip coroutine jalan di loop Satpam tanpa ditunggu. Balikin Future, None kalau Satpam belum nyala."""
+        if cls._loop and cls._loop.is_running():
+            return asyncio.run_coroutine_threadsafe(coroutine, cls._loop)
+        return None
+
+    @classmethod
+    def get_connected_client(cls, user_id):
+        """Client Satpam yang lagi konek buat user ini (None kalau gak ada). Cuma boleh dipake di loop Satpam."""
+        prefix = f"{user_id}_"
+        for key, client in cls._clients.items():
+            if key.startswith(prefix) and client.is_connected():
+                return client
+        return None
 
     @classmethod
     def start(cls):
@@ -884,57 +1522,86 @@ class AutoReplyService:
     def _background_process(cls):
         """Membuat Event Loop khusus untuk Thread Satpam"""
         cls._loop = asyncio.new_event_loop()
+        # Executor default dibatesin: to_thread (query Supabase) gak ngebanjirin thread pas akun banyak
+        cls._loop.set_default_executor(ThreadPoolExecutor(max_workers=8, thread_name_prefix="satpam"))
         asyncio.set_event_loop(cls._loop)
         cls._loop.run_until_complete(cls._main_supervisor())
 
+    @classmethod
+    async def _reply_log_flusher(cls):
+        """Kumpulin row reply_logs maks 100 / 2 detik, terus upsert sekaligus (1 HTTP call per batch)."""
+        while True:
+            rows = {}
+            row = await cls._log_queue.get()
+            rows[(row['user_id'], row['sender_id'])] = row
+            deadline = cls._loop.time() + cls.REPLY_LOG_FLUSH_SEC
+            while len(rows) < cls.REPLY_LOG_BATCH:
+                timeout = deadline - cls._loop.time()
+                if timeout <= 0: break
+                try:
+                    row = await asyncio.wait_for(cls._log_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                # Sender sama di 1 batch -> ambil yang terbaru (ON CONFLICT gak boleh kena row 2x)
+                rows[(row['user_id'], row['sender_id'])] = row
+            try:
+                batch = list(rows.values())
+                await asyncio.to_thread(
+                    lambda: supabase.table('reply_logs').upsert(batch, on_conflict="user_id, sender_id").execute()
+                )
+            except Exception as e:
+                logger.error(f"ReplyLog Batch Error: {e}")
+
     @classmethod
     async def _main_supervisor(cls):
         logger.info("👀 [SATPAM] Mulai patroli hemat RAM...")
+        cls._log_queue = asyncio.Queue()
+        cls._reconcile_event = asyncio.Event()
+        asyncio.create_task(cls._reply_log_flusher())
         while True:
             try:
                 if supabase:
-                    # 1. Ambil list akun Telegram yang terdaftar & aktif sesinya
-                    acc_res = supabase.table('telegram_accounts').select("*").eq('is_active', True).execute()
-                    all_accounts = acc_res.data or []
-                    
-                    # 2. Ambil settingan Auto Reply yang statusnya ON (True)
+                    # 1. Ambil akun Telegram aktif yang settingan Auto Reply nomornya ON (True)
+                    # 1 query ke view (join akun x settingan di Postgres, lihat sql/v_active_autoreply.sql)
                     # Kita cuma mau akun yang DI-IZINKAN NYALA
-                    settings_res = supabase.table('auto_reply_settings').select("target_phone").eq('is_active', True).execute()
-                    allowed_phones = [s['target_phone'] for s in settings_res.data]
-                    
-                    # Tambahan: Kalau ada setting 'all' yang aktif, berarti semua akun boleh nyala?
-                    # Strategi Hemat RAM: TIDAK. Kita paksa user nyalain per akun biar sadar resource.
-                    # Tapi kalau lu mau 'all' ngetrigger semua, uncomment baris bawah:
-                    # if 'all' in allowed_phones: allowed_phones = [a['phone_number'] for a in all_accounts]
+                    # Strategi Hemat RAM: setting 'all' TIDAK ngetrigger semua akun.
+                    # Kita paksa user nyalain per akun biar sadar resource.
+                    acc_res = supabase.table('v_active_autoreply').select("*").execute()
+                    allowed_accounts = acc_res.data or []
 
-                    active_keys = []
-                    
-                    for acc in all_accounts:
-                        phone = AutoReplyManager.normalize_phone(acc['phone_number'])
-                        
-                        # SYARAT LOGIN: 
-                        # 1. Nomor HP ada di daftar allowed_phones (Status ON)
-                        if phone in allowed_phones:
-                            key = f"{acc['user_id']}_{acc['phone_number']}"
-                            active_keys.append(key)
-                            
-                            if key not in cls._clients:
-                                await cls._start_client(acc, key)
-                        else:
-                            # Kalau status OFF tapi masih connect, matikan (Hemat RAM)
-                            key = f"{acc['user_id']}_{acc['phone_number']}"
-                            if key in cls._clients:
-                                await cls._stop_client(key)
+                    # Rekonsiliasi pake selisih set: yang harus nyala vs yang lagi jalan
+                    desired = {f"{acc['user_id']}_{acc['phone_number']}": acc for acc in allowed_accounts}
+                    running = set(cls._clients)
+                    to_start = [cls._start_client(desired[key], key) for key in desired.keys() - running]
+
+                    # Konek MTProto barengan (maks START_CONCURRENCY sekaligus), gak nunggu satu-satu
+                    if to_start:
+                        start_slots = asyncio.Semaphore(cls.START_CONCURRENCY)
+
+                        async def _limited(coro):
+                            async with start_slots:
+                                await coro
+
+                        await asyncio.gather(*(_limited(c) for c in to_start), return_exceptions=True)
                     
-                    # 3. Cleanup sisa
-                    for existing_key in list(cls._clients.keys()):
-                        if existing_key not in active_keys:
-                            await cls._stop_client(existing_key)
+                    # 2. Cleanup sisa (status OFF / akun dihapus tapi masih connect -> matikan, Hemat RAM)
+                    stale_keys = running - desired.keys()
+                    if stale_keys:
+                        await asyncio.gather(*(cls._stop_client(k) for k in stale_keys), return_exceptions=True)
                             
             except Exception as e:
                 logger.error(f"⚠️ [SATPAM] Supervisor Error: {e}")
             
-            await asyncio.sleep(25) # Cek tiap 25 detik
+            # Tidur sampai ada perubahan (request_reconcile) atau ~5 menit
+            # (dikasih jitter +-10% biar beberapa worker gak nembak Supabase barengan)
+            try:
+                await asyncio.wait_for(
+                    cls._reconcile_event.wait(),
+                    cls.RECONCILE_INTERVAL * random.uniform(0.9, 1.1)
+                )
+            except asyncio.TimeoutError:
+                pass
+            cls._reconcile_event.clear()
 
     @classmethod
     async def _start_client(cls, acc_data, key):
@@ -950,69 +1617,75 @@ class AutoReplyService:
                 await client.disconnect()
                 return
 
-            # Data Penting
+            # Data Penting (id akun sendiri diambil sekali, handler gak perlu get_me() per pesan)
+            my_id = (await client.get_me()).id
             user_id = acc_data['user_id']
             # Normalize nomor HP dari DB biar cocok sama settingan
             my_phone = AutoReplyManager.normalize_phone(acc_data['phone_number'])
 
             # --- 3. PASANG EVENT HANDLER (INTI LOGIC) ---
-            @client.on(events.NewMessage(incoming=True))
+            # A. FILTER AWAL (Anti Spam Grup/Channel) -> dicek Telethon sebelum handler jalan, STOP KALAU DARI GRUP!
+            @client.on(events.NewMessage(incoming=True, func=is_private_incoming))
             async def incoming_handler(event):
                 try:
-                    # A. FILTER AWAL (Anti Spam Grup/Channel)
-                    me_obj = await client.get_me()
-                    if event.sender_id == me_obj.id or event.message.via_bot_id: return
-                    if event.is_group or event.is_channel: return # STOP KALAU DARI GRUP!
-
-                    sender_id = event.sender_id
+                    sender_id = event.message.peer_id.user_id
+                    if sender_id == my_id: return
                     chat_text = event.raw_text.lower().strip()
                     
-                    # B. AMBIL SETTINGAN (Realtime dari DB)
+                    # B. AMBIL SETTINGAN (Cache RAM dulu, DB cuma kalau cache kosong/basi)
                     # Panggil Manager: "Eh, akun nomor HP ini settingannya apa?"
-                    settings = AutoReplyManager.get_settings(user_id, my_phone)
+                    # (Cache hit dibaca langsung; query DB jalan di thread lain biar event loop Telethon gak ke-block)
+                    settings = AutoReplyManager.peek_cached(
+                        AutoReplyManager._settings_cache, AutoReplyManager._settings_lock, (user_id, my_phone)
+                    )
+                    if settings is None:
+                        settings = await asyncio.to_thread(AutoReplyManager.get_settings, user_id, my_phone)
                     
                     # Kalau fitur dimatikan, cuekin aja
                     if not settings or not settings.get('is_active'): return
 
                     # C. LOGIC PENCARIAN KEYWORD
-                    keywords = AutoReplyManager.get_keywords(user_id)
+                    keywords = AutoReplyManager.peek_cached(
+                        AutoReplyManager._keywords_cache, AutoReplyManager._keywords_lock, user_id
+                    )
+                    if keywords is None:
+                        fetched = await asyncio.to_thread(AutoReplyManager.get_keywords, user_id)
+                        # Pake list asli di cache biar matcher yang udah jadi bisa dipake ulang
+                        keywords = AutoReplyManager.peek_cached(
+                            AutoReplyManager._keywords_cache, AutoReplyManager._keywords_lock, user_id
+                        )
+                        if keywords is None: keywords = fetched
                     response_text = None
 
-                    # Prioritas: 
-                    # 1. Cari keyword yang TARGETNYA == NOMOR INI
-                    specific_rules = [r for r in keywords if AutoReplyManager.normalize_phone(r.get('target_phone')) == my_phone]
-                    # 2. Cari keyword yang TARGETNYA == ALL
-                    global_rules = [r for r in keywords if r.get('target_phone') == 'all']
-                    
-                    # Gabung (Specific duluan biar menang)
-                    all_rules = specific_rules + global_rules
-
-                    for rule in all_rules:
-                        # 1. Ambil keyword dari database, split berdasarkan koma
-                        # Contoh di DB: "halo, hai, pagi kak" -> jadi list ['halo', 'hai', 'pagi kak']
-                        trigger_words = [w.strip() for w in rule['keyword'].split(',') if w.strip()]
-                        
-                        # 2. Cek apakah ada SATU SAJA dari kata/frasa itu di dalam chat_text
-                        matched = any(word in chat_text for word in trigger_words)
-                        
-                        if matched:
-                            response_text = rule['response']
-                            logger.info(f"✅ [SATPAM] {my_phone} menjawab trigger ke {sender_id}")
-                            break
+                    # Automaton (Aho-Corasick) dibangun sekali per set keyword -> 1x scan per pesan
+                    # buat semua trigger (keyword di DB dipisah koma: "halo, hai, pagi kak")
+                    rule = cls._get_matcher(user_id, my_phone, keywords).match(chat_text)
+                    if rule:
+                        response_text = rule['response']
+                        logger.info(f"✅ [SATPAM] {my_phone} menjawab trigger ke {sender_id}")
                     
                     # D. LOGIC WELCOME MESSAGE (Jika gak ada keyword)
+                    welcome_claimed = False
                     if not response_text and settings.get('welcome_message'):
                         # Cek Cooldown (Jeda Spam)
                         cooldown_min = settings.get('cooldown_minutes', 60)
-                        log_res = supabase.table('reply_logs').select("last_reply_at")\
-                            .eq('user_id', user_id).eq('sender_id', sender_id).execute()
-                        
-                        should_reply = True
-                        if log_res.data:
-                            last_time = datetime.fromisoformat(log_res.data[0]['last_reply_at'].replace('Z', '+00:00'))
-                            diff_min = (datetime.now(pytz.utc) - last_time).total_seconds() / 60
-                            # Kalau masih dalam masa cooldown, jangan bales
-                            if diff_min < cooldown_min: should_reply = False
+                        cooldown_key = (user_id, sender_id)
+                        last_ts = ReplyEngine._get_last_reply(cooldown_key)
+                        if last_ts is not None and (time.time() - last_ts) < cooldown_min * 60:
+                            # Pre-check lokal: baru aja dibales (LRU RAM, dipake bareng ReplyEngine) -> gak usah nanya DB
+                            should_reply = False
+                        else:
+                            # Keputusan final: cek + catat cooldown sekaligus di Postgres (atomik -> anti dobel welcome)
+                            # FALSE = masih dalam masa cooldown, jangan bales
+                            claim_res = await asyncio.to_thread(
+                                lambda: supabase.rpc('claim_welcome', {
+                                    'p_user_id': user_id, 'p_sender_id': sender_id, 'p_cooldown_min': cooldown_min
+                                }).execute()
+                            )
+                            should_reply = bool(claim_res.data)
+                            welcome_claimed = should_reply
+                            # Klaim langsung dicatat di LRU (sebelum ngetik/kirim) biar pesan berikutnya ketahan pre-check
+                            if welcome_claimed: ReplyEngine._remember_reply(cooldown_key, time.time())
                         
                         if should_reply:
                             response_text = settings.get('welcome_message')
@@ -1033,13 +1706,14 @@ class AutoReplyService:
                         # Kirim balasannya!
                         await event.reply(response_text)
                         
-                        # Catat log biar cooldown jalan
-                        log_data = {
-                            'user_id': user_id, 
-                            'sender_id': sender_id, 
-                            'last_reply_at': datetime.utcnow().isoformat()
-                        }
-                        supabase.table('reply_logs').upsert(log_data, on_conflict="user_id, sender_id").execute()
+                        # Welcome hasil claim_welcome udah kecatat (LRU + DB), balasan keyword dicatat di sini
+                        if not welcome_claimed:
+                            ReplyEngine._remember_reply((user_id, sender_id), time.time())
+                            cls._log_queue.put_nowait({
+                                'user_id': user_id, 
+                                'sender_id': sender_id, 
+                                'last_reply_at': datetime.utcnow().isoformat()
+                            })
 
                 except Exception as handler_e:
                     logger.error(f"Handler Error {my_phone}: {handler_e}")
@@ -1063,6 +1737,90 @@ class AutoReplyService:
 # SECTION 5: DATA ACCESS LAYER (DAL)
 # ==============================================================================
 
+@dataclass(slots=True)
+class TeleInfo:
+    """Info akun Telegram yang nempel di UserEntity."""
+    phone_number: str = None
+    is_active: bool = False
+    session_string: str = None
+
+@dataclass(slots=True)
+class UserEntity:
+    """Wrapper data user (users + telegram_accounts) buat route & template."""
+    id: int
+    email: str
+    is_admin: bool = False
+    is_banned: bool = False
+    referral_code: str = '-'
+    wallet_balance: int = 0
+    notification_chat_id: str = None
+    verification_token: str = None
+    verification_token_expires_at: datetime = None
+    created_at: datetime = None
+    plan_tier: str = 'Starter'
+    days_remaining: int = 0
+    subscription_status: str = 'Expired'
+    sub_end_date: datetime = None
+    telegram_account: TeleInfo = None
+
+    @classmethod
+    def from_rows(cls, u_data, t_data):
+        user = cls(
+            id=u_data['id'],
+            email=u_data['email'],
+            is_admin=u_data.get('is_admin', False),
+            is_banned=u_data.get('is_banned', False),
+            # --- REFERRAL & WALLET ---
+            referral_code=u_data.get('referral_code', '-'),
+            wallet_balance=u_data.get('wallet_balance', 0),
+            notification_chat_id=u_data.get('notification_chat_id'), # Buat cek status bot
+            verification_token=u_data.get('verification_token'),
+            plan_tier=u_data.get('plan_tier', 'Starter') # Default Starter
+        )
+
+        # Parsing Tanggal Join
+        raw_created = u_data.get('created_at')
+        try:
+            user.created_at = datetime.fromisoformat(raw_created.replace('Z', '+00:00')) if raw_created else datetime.now()
+        except:
+            user.created_at = datetime.now()
+
+        # Expired token deep-link bot (None = belum ada / format aneh -> dianggap expired)
+        raw_token_exp = u_data.get('verification_token_expires_at')
+        if raw_token_exp:
+            try:
+                user.verification_token_expires_at = datetime.fromisoformat(raw_token_exp.replace('Z', '+00:00'))
+            except ValueError:
+                pass
+
+        # --- SUBSCRIPTION: Hitung Sisa Hari ---
+        raw_sub_end = u_data.get('subscription_end')
+        if raw_sub_end:
+            try:
+                # Parsing tanggal expire
+                end_date = datetime.fromisoformat(raw_sub_end.replace('Z', '+00:00'))
+                user.sub_end_date = end_date
+                
+                # Hitung selisih hari dari SEKARANG (UTC)
+                delta = end_date - datetime.now(pytz.utc)
+                
+                if delta.days >= 0:
+                    user.days_remaining = delta.days
+                    user.subscription_status = 'Active'
+                else:
+                    user.plan_tier = 'Starter' # Downgrade otomatis visualnya
+            except Exception as e:
+                logger.error(f"Date Parse Error: {e}")
+
+        # Nested Object for Telegram Info
+        if t_data:
+            user.telegram_account = TeleInfo(
+                phone_number=t_data.get('phone_number'),
+                is_active=t_data.get('is_active', False),
+                session_string=t_data.get('session_string')
+            )
+        return user
+
 def get_user_data(user_id):
     """
     Mengambil data User lengkap dengan status Subscription & Telegram.
@@ -1079,69 +1837,36 @@ def get_user_data(user_id):
         tele_raw = t_res.data[0] if t_res.data else None
         
         # 3. Create Wrapper Object
-        class UserEntity:
-            def __init__(self, u_data, t_data):
-                self.id = u_data['id']
-                self.email = u_data['email']
-                self.is_admin = u_data.get('is_admin', False)
-                self.is_banned = u_data.get('is_banned', False)
-                
-                # ... (Kode lama parsing tanggal dll biarin aja) ...
-        
-                # --- [TAMBAHAN BARU] REFERRAL & WALLET ---
-                self.referral_code = u_data.get('referral_code', '-')
-                self.wallet_balance = u_data.get('wallet_balance', 0)
-                self.notification_chat_id = u_data.get('notification_chat_id') # Buat cek status bot
-                
-                # Parsing Tanggal Join
-                raw_created = u_data.get('created_at')
-                try:
-                    self.created_at = datetime.fromisoformat(raw_created.replace('Z', '+00:00')) if raw_created else datetime.now()
-                except:
-                    self.created_at = datetime.now()
-
-                # --- LOGIC BARU: SUBSCRIPTION ---
-                self.plan_tier = u_data.get('plan_tier', 'Starter') # Default Starter
-                
-                # Hitung Sisa Hari
-                raw_sub_end = u_data.get('subscription_end')
-                self.days_remaining = 0
-                self.subscription_status = 'Expired'
-                self.sub_end_date = None
-
-                if raw_sub_end:
-                    try:
-                        # Parsing tanggal expire
-                        end_date = datetime.fromisoformat(raw_sub_end.replace('Z', '+00:00'))
-                        self.sub_end_date = end_date
-                        
-                        # Hitung selisih hari dari SEKARANG (UTC)
-                        now = datetime.now(pytz.utc)
-                        delta = end_date - now
-                        
-                        if delta.days >= 0:
-                            self.days_remaining = delta.days
-                            self.subscription_status = 'Active'
-                        else:
-                            self.days_remaining = 0
-                            self.plan_tier = 'Starter' # Downgrade otomatis visualnya
-                    except Exception as e:
-                        logger.error(f"Date Parse Error: {e}")
-
-                # Nested Object for Telegram Info
-                self.telegram_account = None
-                if t_data:
-                    self.telegram_account = type('TeleInfo', (object,), {
-                        'phone_number': t_data.get('phone_number'),
-                        'is_active': t_data.get('is_active', False),
-                        'session_string': t_data.get('session_string')
-                    })
-        
-        return UserEntity(user_raw, tele_raw)
+        return UserEntity.from_rows(user_raw, tele_raw)
     except Exception as e:
         logger.error(f"DAL Error (get_user_data): {e}")
         return None
 
+# Cache get_user_data buat cek hak akses & konteks dashboard: user_id -> (UserEntity, expired_at)
+USER_CACHE_TTL = 30
+USER_CACHE_MAX = 10000
+_USER_CACHE = {}
+_USER_CACHE_LOCK = threading.Lock()
+
+def get_user_data_cached(user_id):
+    """get_user_data versi cache TTL pendek (admin_required & get_dashboard_context)."""
+    with _USER_CACHE_LOCK:
+        cached = _USER_CACHE.get(user_id)
+        if cached and time.time() < cached[1]:
+            return cached[0]
+
+    user = get_user_data(user_id)
+    if user:
+        with _USER_CACHE_LOCK:
+            if len(_USER_CACHE) >= USER_CACHE_MAX: _USER_CACHE.clear()
+            _USER_CACHE[user_id] = (user, time.time() + USER_CACHE_TTL)
+    return user
+
+def invalidate_user_cache(user_id):
+    """Buang cache user. Panggil tiap kali data akun / status user berubah."""
+    with _USER_CACHE_LOCK:
+        _USER_CACHE.pop(user_id, None)
+
 async def get_active_client(user_id):
     """
     Membangun koneksi Telethon Client aktif dari Database.
@@ -1150,7 +1875,10 @@ async def get_active_client(user_id):
     if not supabase: return None
     try:
         # Hanya ambil akun yang ditandai ACTIVE di database
-        res = supabase.table('telegram_accounts').select("session_string").eq('user_id', user_id).eq('is_active', True).execute()
+        # (query di thread lain -> aman dipanggil dari loop Satpam yang dipake bareng)
+        res = await asyncio.to_thread(
+            lambda: supabase.table('telegram_accounts').select("session_string").eq('user_id', user_id).eq('is_active', True).execute()
+        )
         
         if not res.data:
             logger.warning(f"Client Init: No active session for UserID {user_id}")
@@ -1168,7 +1896,11 @@ async def get_active_client(user_id):
             await client.disconnect()
             
             # Auto-update status di DB jadi Inactive agar UI dashboard update
-            supabase.table('telegram_accounts').update({'is_active': False}).eq('user_id', user_id).execute()
+            await asyncio.to_thread(
+                lambda: supabase.table('telegram_accounts').update({'is_active': False}).eq('user_id', user_id).execute()
+            )
+            AutoReplyService.request_reconcile()
+            invalidate_user_cache(user_id)
             return None
 
         # --- [INI YANG BIKIN ERROR TADI - SEKARANG UDAH RAPI] 
@@ -1215,8 +1947,8 @@ def admin_required(f):
         if 'user_id' not in session: 
             return redirect(url_for('login'))
         
-        # Cek hak akses admin dari database
-        user = get_user_data(session['user_id'])
+        # Cek hak akses admin dari database (cache 30 detik)
+        user = get_user_data_cached(session['user_id'])
         if not user or not user.is_admin:
             flash('⛔ Security Alert: Akses Ditolak. Area ini dipantau.', 'danger')
             return redirect(url_for('dashboard_overview'))
@@ -1447,9 +2179,7 @@ def verify_email(token):
 def logout():
     uid = session.get('user_id')
     # Cleanup memory cache jika ada
-    if uid and uid in login_states:
-        try: del login_states[uid]
-        except: pass
+    if uid: state_store.delete(_otp_key(uid))
         
     session.pop('user_id', None)
     return redirect(url_for('index'))
@@ -1460,7 +2190,8 @@ def logout():
 
 # Helper untuk memvalidasi user sebelum render dashboard
 def get_dashboard_context():
-    user = get_user_data(session['user_id'])
+    # Cache 30 detik; tiap perubahan user / akun Telegram manggil invalidate_user_cache
+    user = get_user_data_cached(session['user_id'])
     if not user:
         session.pop('user_id', None)
         return None
@@ -1470,6 +2201,21 @@ def get_dashboard_context():
         return None
     return user
 
+# Cursor keyset buat pagination log: "<created_at>|<id>" dari baris pertama / terakhir halaman
+def make_log_cursor(row):
+    return f"{row['created_at']}|{row['id']}"
+
+def parse_log_cursor(raw):
+    """Balikin (created_at, id) kalau cursor valid, None kalau kosong / diutak-atik"""
+    if not raw or '|' not in raw: return None
+    ts, _, row_id = raw.rpartition('|')
+    if not row_id.isdigit(): return None
+    try:
+        datetime.fromisoformat(ts.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return ts, row_id
+
 @app.route('/dashboard')
 @login_required
 def dashboard_overview():
@@ -1493,25 +2239,58 @@ def dashboard_overview():
     per_page = request.args.get('per_page', 10, type=int)
     start = (page - 1) * per_page
     end = start + per_page - 1
+    # Prev/Next bawa cursor -> query index range (user_id, created_at, id), gak OFFSET yang makin dalam makin lambat
+    after = parse_log_cursor(request.args.get('after'))
+    before = parse_log_cursor(request.args.get('before'))
     
     logs = []
     schedules = []
     targets = []
     total_logs = 0
     total_pages = 0
+    next_cursor = prev_cursor = None
     stats = {} # [FIX 2] Container untuk statistik kartu
+
+    def _fetch_logs():
+        q = supabase.table('blast_logs').select("id, created_at, status, group_name, error_message").eq('user_id', uid)
+        if after:
+            ts, row_id = after
+            return q.or_(f'created_at.lt."{ts}",and(created_at.eq."{ts}",id.lt.{row_id})')\
+                .order('created_at', desc=True).order('id', desc=True).limit(per_page).execute()
+        if before:
+            # Mundur: ambil ascending dari cursor, nanti dibalik lagi
+            ts, row_id = before
+            res = q.or_(f'created_at.gt."{ts}",and(created_at.eq."{ts}",id.gt.{row_id})')\
+                .order('created_at').order('id').limit(per_page).execute()
+            res.data = list(reversed(res.data or []))
+            return res
+        # Tanpa cursor (halaman 1 / link langsung ?page=N) -> offset biasa
+        return q.order('created_at', desc=True).order('id', desc=True).range(start, end).execute()
     
     if supabase:
         try:
+            # Query-query ini gak saling bergantung -> tembak barengan biar latency = RTT paling lambat
+            # (total log & log SUCCESS dihitung sekali scan di RPC blast_log_stats, lihat sql/blast_log_stats.sql)
+            f_logs = _DB_POOL.submit(_fetch_logs)
+            f_sched = _DB_POOL.submit(lambda: supabase.table('blast_schedules').select("id, is_active").eq('user_id', uid).execute())
+            f_tgt = _DB_POOL.submit(lambda: supabase.table('blast_targets').select("id").eq('user_id', uid).execute())
+            f_acc = _DB_POOL.submit(lambda: supabase.table('telegram_accounts').select("id", count='exact', head=True)
+                .eq('user_id', uid).eq('is_active', True).execute())
+            f_stats = _DB_POOL.submit(lambda: supabase.rpc('blast_log_stats', {'uid': uid}).execute())
+            logs_res, sched_res, tgt_res, acc_res, stats_res = (
+                f_logs.result(), f_sched.result(), f_tgt.result(), f_acc.result(), f_stats.result()
+            )
+            log_stats = stats_res.data[0] if stats_res.data else {}
+
             # A. Pagination Logs
-            count_res = supabase.table('blast_logs').select("id", count='exact', head=True).eq('user_id', uid).execute()
-            total_logs = count_res.count if count_res.count else 0
-            import math
-            total_pages = math.ceil(total_logs / per_page)
+            total_logs = log_stats.get('total') or 0
+            total_pages = (total_logs + per_page - 1) // per_page if per_page > 0 else 0  # ceil-div integer
 
             # 1. Ambil data mentah dari database
-            logs_raw = supabase.table('blast_logs').select("*").eq('user_id', uid)\
-                .order('created_at', desc=True).range(start, end).execute().data
+            logs_raw = logs_res.data
+            if logs_raw:
+                prev_cursor = make_log_cursor(logs_raw[0])
+                next_cursor = make_log_cursor(logs_raw[-1])
 
             # 2. [UPGRADE] Konversi Zona Waktu (UTC ke WIB)
             logs = []
@@ -1535,12 +2314,12 @@ def dashboard_overview():
                     logs.append(log)
             
             # B. Ambil Data Jadwal & Target
-            schedules = supabase.table('blast_schedules').select("*").eq('user_id', uid).execute().data
-            targets = supabase.table('blast_targets').select("*").eq('user_id', uid).execute().data
+            schedules = sched_res.data
+            targets = tgt_res.data
             
             # C. Hitung Statistik Ringkas (Buat Kartu Atas)
-            acc_count = supabase.table('telegram_accounts').select("id", count='exact', head=True).eq('user_id', uid).eq('is_active', True).execute().count
-            success_blast = supabase.table('blast_logs').select("id", count='exact', head=True).eq('user_id', uid).eq('status', 'SUCCESS').execute().count
+            acc_count = acc_res.count
+            success_blast = log_stats.get('ok') or 0
             
             stats = {
                 'connected_accounts': acc_count or 0,
@@ -1563,12 +2342,11 @@ def dashboard_overview():
                            current_page=page,
                            total_pages=total_pages,
                            total_logs=total_logs,
+                           per_page=per_page,
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor,
                            active_page='home') # Ganti 'dashboard' jadi 'home' sesuai base.html
 
-# Variable Global buat kontrol Broadcast
-# Format: {'user_id': 'running' | 'stopped'}
-broadcast_states = {}
-
 @app.route('/dashboard/broadcast')
 @login_required
 def dashboard_broadcast():
@@ -1583,22 +2361,27 @@ def dashboard_broadcast():
     count_selected = 0
     
     try:
+        # 3 read independen (CRM count, template, akun aktif) ditembak barengan
+        f_crm = _DB_POOL.submit(lambda: supabase.table('tele_users').select("id", count='exact', head=True).eq('owner_id', user.id).execute())
+        f_tmpl = _DB_POOL.submit(MessageTemplateManager.get_templates, user.id)
+        # [FIX] Load Active Accounts (Biar Muncul di Tab Pengirim)
+        f_acc = _DB_POOL.submit(lambda: supabase.table('telegram_accounts').select(ACCOUNT_LIST_COLUMNS).eq('user_id', user.id).eq('is_active', True).execute())
+
         # Fetch CRM Count
-        crm_res = supabase.table('tele_users').select("id", count='exact', head=True).eq('owner_id', user.id).execute()
+        crm_res = f_crm.result()
         crm_count = crm_res.count if crm_res.count else 0
         
         # Load Templates
-        templates = MessageTemplateManager.get_templates(user.id)
+        templates = f_tmpl.result()
         
-        # [FIX] Load Active Accounts (Biar Muncul di Tab Pengirim)
-        acc_res = supabase.table('telegram_accounts').select("*").eq('user_id', user.id).eq('is_active', True).execute()
+        acc_res = f_acc.result()
         accounts = acc_res.data if acc_res.data else []
 
         # Tangkap ID dari URL (lemparan dari CRM)
         ids_arg = request.args.get('ids')
         if ids_arg:
             selected_ids = ids_arg
-            count_selected = len(ids_arg.split(','))
+            count_selected = ids_arg.count(',') + 1  # Hitung koma aja, gak perlu bikin list
             
     except Exception as e:
         logger.error(f"Broadcast Page Error: {e}")
@@ -1617,7 +2400,7 @@ def dashboard_broadcast():
 @login_required
 def stop_broadcast_api():
     user_id = session['user_id']
-    broadcast_states[user_id] = 'stopped' # Set Flag Stop
+    state_store.setex(_broadcast_key(user_id), BROADCAST_STATE_TTL, 'stopped') # Set Flag Stop
     return jsonify({'status': 'success', 'message': 'Broadcast stopping...'})
 
 @app.route('/dashboard/targets')
@@ -1634,27 +2417,24 @@ def dashboard_targets():
     accounts = []
     
     try:
+        # 1 & 2 gak saling bergantung -> ditembak barengan
+        f_acc = _DB_POOL.submit(lambda: supabase.table('telegram_accounts').select(ACCOUNT_LIST_COLUMNS).eq('user_id', user.id).eq('is_active', True).execute())
+        f_tgt = _DB_POOL.submit(lambda: supabase.table('blast_targets').select("id, group_id, group_name, topic_ids, source_phone, source_name, template_name, created_at")
+            .eq('user_id', user.id).order('created_at', desc=True).execute())
+
         # 1. Ambil Akun Aktif
-        acc_res = supabase.table('telegram_accounts').select("*").eq('user_id', user.id).eq('is_active', True).execute()
+        acc_res = f_acc.result()
         accounts = acc_res.data if acc_res.data else []
 
         # 2. Ambil Semua Target
-        all_targets = supabase.table('blast_targets').select("*").eq('user_id', user.id).order('created_at', desc=True).execute().data
+        all_targets = f_tgt.result().data
         
         # 3. Logic Grouping (Python Side biar fleksibel)
+        # Satu lookup per level (setdefault), bukan cek-`in` + index ulang 3x per baris
         for t in all_targets:
-            # Key 1: Source Phone (Akun)
-            src = t.get('source_phone') or 'Unknown Account'
-            # Key 2: Template Name (Koleksi)
-            tmpl = t.get('template_name') or 'Tanpa Nama'
-            
-            if src not in grouped_targets:
-                grouped_targets[src] = {}
-            
-            if tmpl not in grouped_targets[src]:
-                grouped_targets[src][tmpl] = []
-                
-            grouped_targets[src][tmpl].append(t)
+            # Key 1: Source Phone (Akun), Key 2: Template Name (Koleksi)
+            grouped_targets.setdefault(t.get('source_phone') or 'Unknown Account', {}) \
+                .setdefault(t.get('template_name') or 'Tanpa Nama', []).append(t)
             
     except Exception as e:
         logger.error(f"Targets Page Error: {e}")
@@ -1670,7 +2450,7 @@ def dashboard_targets():
 @login_required
 def rename_target_template():
     user_id = session['user_id']
-    data = request.json
+    data = get_json_body()
     
     old_name = data.get('old_name')
     new_name = data.get('new_name')
@@ -1696,16 +2476,19 @@ def rename_target_template():
 @login_required
 def update_target_group():
     user_id = session['user_id']
-    data = request.json
+    data = get_json_body()
     
     target_id = data.get('id')
     new_name = data.get('group_name')
     new_topics = data.get('topic_ids') # String "123, 456" atau None
     
+    if not target_id or not new_name:
+        return jsonify({'status': 'error', 'message': 'Data tidak lengkap'})
+    
     try:
         update_payload = {
             'group_name': new_name,
-            'topic_ids': new_topics
+            'topic_ids': normalize_topic_ids(new_topics)
         }
         
         supabase.table('blast_targets').update(update_payload)\
@@ -1730,24 +2513,27 @@ def dashboard_schedule():
     accounts = []  # List akun aktif
     
     try:
+        # Jadwal, template, target & akun gak saling bergantung -> ditembak barengan
+        f_sched = _DB_POOL.submit(lambda: supabase.table('blast_schedules').select("*").eq('user_id', user.id).order('run_hour', desc=False).execute())
+        f_tmpl = _DB_POOL.submit(MessageTemplateManager.get_templates, user.id)
+        f_tgt = _DB_POOL.submit(lambda: supabase.table('blast_targets').select("*").eq('user_id', user.id).execute())
+        # [UPGRADE] Ambil akun yang AKTIF saja buat dropdown
+        f_acc = _DB_POOL.submit(lambda: supabase.table('telegram_accounts').select("phone_number").eq('user_id', user.id).eq('is_active', True).execute())
+
         # Ambil jadwal lama
-        schedules = supabase.table('blast_schedules').select("*").eq('user_id', user.id).order('run_hour', desc=False).execute().data
+        schedules = f_sched.result().data
         
         # Fetch Data Pendukung
-        templates = MessageTemplateManager.get_templates(user.id)
-        targets = supabase.table('blast_targets').select("*").eq('user_id', user.id).execute().data
+        templates = f_tmpl.result()
+        targets = f_tgt.result().data
         
-        # [UPGRADE] Ambil akun yang AKTIF saja buat dropdown
-        acc_res = supabase.table('telegram_accounts').select("phone_number").eq('user_id', user.id).eq('is_active', True).execute()
+        acc_res = f_acc.result()
         accounts = acc_res.data if acc_res.data else []
         
-        # Enrich schedule data with template names
+        # Enrich schedule data with template names (lookup dict, bukan scan list per jadwal)
+        tmpl_by_id = {t['id']: t['name'] for t in templates}
         for s in schedules:
-            t_id = s.get('template_id')
-            s['template_name'] = 'Custom / No Template'
-            if t_id:
-                found = next((t for t in templates if t['id'] == t_id), None)
-                if found: s['template_name'] = found['name']
+            s['template_name'] = tmpl_by_id.get(s.get('template_id'), 'Custom / No Template')
         
     except Exception as e:
         logger.error(f"Schedule Page Error: {e}")
@@ -1787,12 +2573,14 @@ def dashboard_crm():
     # 1. Ambil List Akun Yang AKTIF Saja (Untuk Navigasi Folder)
     accounts = []
     active_phones = []
+    active_phone_set = frozenset()
     try:
-        acc_res = supabase.table('telegram_accounts').select("*")\
+        acc_res = supabase.table('telegram_accounts').select(ACCOUNT_LIST_COLUMNS)\
             .eq('user_id', user.id).eq('is_active', True)\
             .order('created_at', desc=True).execute()
         accounts = acc_res.data if acc_res.data else []
-        active_phones = [acc['phone_number'] for acc in accounts]
+        active_phones = [acc['phone_number'] for acc in accounts]  # List buat filter in_() ke Supabase
+        active_phone_set = frozenset(active_phones)                 # Set buat cek membership O(1)
     except Exception as e:
         logger.error(f"Fetch Accounts Error: {e}")
 
@@ -1814,12 +2602,12 @@ def dashboard_crm():
     if supabase:
         try:
             # Base Query
-            query = supabase.table('tele_users').select("*", count='exact').eq('owner_id', user.id)
+            query = supabase.table('tele_users').select("id, user_id, username, first_name, source_phone, last_interaction", count='exact').eq('owner_id', user.id)
             
             # --- LOGIC FOLDER ---
             if current_source != 'all':
                 # Filter hanya data milik akun tertentu
-                if current_source in active_phones:
+                if current_source in active_phone_set:
                     query = query.eq('source_phone', current_source)
                 else:
                     # Kalau user iseng ganti URL ke akun yg gak aktif/gak ada -> Kosongkan hasil
@@ -1832,6 +2620,7 @@ def dashboard_crm():
                     query = query.eq('id', -1)
 
             # --- [UPGRADE KASTA DEWA]: Filter Pencarian Super Cerdas ---
+            # ILIKE '%q%' di username/first_name ditopang index GIN trigram (sql/tele_users_search_trgm.sql)
             if search_query:
                 # Cek apakah user ngetik angka (nyari ID) atau Teks (nyari Nama/Username)
                 if search_query.isdigit():
@@ -1850,8 +2639,7 @@ def dashboard_crm():
             crm_users = res.data if res.data else []
             total_users = res.count if res.count else 0
             
-            import math
-            total_pages = math.ceil(total_users / per_page) if per_page > 0 else 0
+            total_pages = (total_users + per_page - 1) // per_page if per_page > 0 else 0  # ceil-div integer
             
         except Exception as e:
             logger.error(f"CRM Data Error: {e}")
@@ -1881,7 +2669,7 @@ def dashboard_connection():
     # [UPGRADE] Ambil SEMUA akun telegram milik user ini
     accounts = []
     try:
-        res = supabase.table('telegram_accounts').select("*").eq('user_id', user.id).order('created_at', desc=True).execute()
+        res = supabase.table('telegram_accounts').select(ACCOUNT_LIST_COLUMNS).eq('user_id', user.id).order('created_at', desc=True).execute()
         accounts = res.data if res.data else []
     except Exception as e:
         logger.error(f"Fetch Accounts Error: {e}")
@@ -1901,6 +2689,8 @@ def disconnect_account():
     try:
         # Hapus baris berdasarkan user_id DAN nomor hp
         supabase.table('telegram_accounts').delete().eq('user_id', user_id).eq('phone_number', phone).execute()
+        AutoReplyService.request_reconcile()
+        invalidate_user_cache(user_id)
         
         # Hapus session file/cache memory jika ada
         # (Opsional: tambahkan logic cleanup telethon session string)
@@ -1916,23 +2706,30 @@ def dashboard_profile():
     user = get_user_data(session['user_id'])
     if not user: return redirect(url_for('login'))
     
-    # 1. Generate Token Unik buat Deep Linking
-    import uuid
-    verify_token = str(uuid.uuid4())
-    
-    # 2. Simpan Token ke DB
-    supabase.table('users').update({'verification_token': verify_token}).eq('id', user.id).execute()
+    # 1. Token Deep Linking: pake ulang yang masih berlaku, generate baru cuma kalau kosong / expired
+    # (dulu tiap buka halaman ini nulis token baru ke DB)
+    verify_token = user.verification_token
+    token_exp = user.verification_token_expires_at
+    if not verify_token or not token_exp or token_exp <= datetime.now(pytz.utc):
+        import uuid
+        verify_token = str(uuid.uuid4())
+        
+        # 2. Simpan Token + masa berlaku (24 jam) ke DB
+        supabase.table('users').update({
+            'verification_token': verify_token,
+            'verification_token_expires_at': (datetime.now(pytz.utc) + timedelta(hours=24)).isoformat()
+        }).eq('id', user.id).execute()
+        invalidate_user_cache(user.id)
+    # User lagi (re)connect bot -> chat_id bisa berubah, jangan pake cache lama
+    invalidate_notif_chat_cache(user.id)
     
     # 3. Bikin Link Bot (Ambil username bot dari env)
     bot_username = os.getenv('NOTIF_BOT_USERNAME', 'NamaBotLu_bot') 
     bot_link = f"https://t.me/{bot_username}?start={verify_token}"
     
     # 4. Cek Status Koneksi Notif (User udah connect bot belum?)
-    # Kita cek manual field notification_chat_id dari database raw karena di wrapper get_user_data mungkin belum ada
-    raw_user = supabase.table('users').select("notification_chat_id").eq('id', user.id).execute()
-    is_notif_connected = False
-    if raw_user.data and raw_user.data[0]['notification_chat_id']:
-        is_notif_connected = True
+    # notification_chat_id udah ikut ke-select di get_user_data, gak perlu query lagi
+    is_notif_connected = bool(user.notification_chat_id)
 
     return render_template('dashboard/profile.html', 
                            user=user, 
@@ -1945,13 +2742,14 @@ def dashboard_profile():
 def dashboard_payment():
     user = get_dashboard_context()
     # Ambil data dinamis dari DB
-    plans_data = FinanceManager.get_plans_structure()
-    banks = supabase.table('admin_banks').select("*").eq('is_active', True).execute().data
+    # Dua-duanya di-cache di FinanceManager (harga + rekening jarang berubah)
+    plans_json = FinanceManager.get_plans_json()
+    banks = FinanceManager.get_active_banks()
     
     return render_template('dashboard/payment.html', 
                            user=user, 
                            active_page='payment',
-                           plans_json=json.dumps(plans_data), # Kirim JSON ke JS
+                           plans_json=plans_json, # Kirim JSON ke JS
                            banks=banks)
 
 # --- [TAMBAHAN WAJIB] API CHECKOUT USER ---
@@ -1983,15 +2781,48 @@ def api_checkout():
 # SECTION 9: TELEGRAM AUTHENTICATION (CORE LOGIC & STATELESS)
 # ==============================================================================
 
+# Client OTP yang masih konek dari send_code, dipake ulang verify_code (hemat 1 handshake MTProto).
+# Key: (user_id, phone) -> (client, loop, expires_at). Cuma disentuh dari dalam event loop.
+PENDING_CLIENT_TTL = 300
+_pending_clients = {}
+
+def _park_pending_client(key, client):
+    """
+    Simpan client yang masih konek buat ronde verify berikutnya (auto-disconnect setelah TTL).
+    Cuma jalan di loop Satpam; di loop fallback run_async (umurnya per request) balikin False -> caller disconnect.
+    """
+    loop = asyncio.get_running_loop()
+    if loop is not AutoReplyService._loop: return False
+    _pending_clients[key] = (client, loop, time.monotonic() + PENDING_CLIENT_TTL)
+    loop.call_later(PENDING_CLIENT_TTL, lambda: asyncio.ensure_future(_expire_pending_client(key, client)))
+    return True
+
+def _take_pending_client(key):
+    """Ambil (dan lepas dari cache) client pending. None kalau gak ada / beda loop / udah putus."""
+    entry = _pending_clients.pop(key, None)
+    if not entry: return None
+    client, loop, _ = entry
+    if loop is not asyncio.get_running_loop() or not client.is_connected():
+        return None
+    return client
+
+async def _expire_pending_client(key, client):
+    entry = _pending_clients.get(key)
+    if entry and entry[0] is client and time.monotonic() >= entry[2]:
+        _pending_clients.pop(key, None)
+        try: await client.disconnect()
+        except Exception: pass
+
 @app.route('/api/connect/send_code', methods=['POST'])
 @login_required
 def send_code():
-    phone = request.json.get('phone')
+    phone = get_json_body().get('phone')
     user_id = session['user_id']
     
     if not phone: return jsonify({'status': 'error', 'message': 'Nomor HP wajib diisi.'})
 
     # --- [UPGRADE KASTA DEWA: LIMIT SESUAI PAKET] ---
+    is_existing_number = None  # None = cek gagal (nanti fallback ke upsert)
     try:
         # Ambil data user (Ini otomatis ngecek expired date juga lho!)
         user_data = get_user_data(user_id)
@@ -2004,13 +2835,12 @@ def send_code():
         elif 'PRO' in plan_tier:
             max_accounts = 3
 
-        # Hitung jumlah akun saat ini di database
-        res = supabase.table('telegram_accounts').select("id", count='exact', head=True).eq('user_id', user_id).execute()
-        current_count = res.count if res.count else 0
+        # 1 query: daftar nomor akun user ini (maks 10) -> jumlah & cek nomor dihitung di Python
+        rows = supabase.table('telegram_accounts').select("phone_number").eq('user_id', user_id).execute().data or []
+        current_count = len(rows)
         
         # Cek apakah nomor ini sudah ada (Re-login) atau nomor baru (New Add)
-        check_exist = supabase.table('telegram_accounts').select("id").eq('user_id', user_id).eq('phone_number', phone).execute()
-        is_existing_number = True if check_exist.data else False
+        is_existing_number = any(r.get('phone_number') == phone for r in rows)
         
         # Logic Limit: Kalau nomor baru DAN jumlah udah mentok -> TOLAK MENTAH-MENTAH
         if not is_existing_number and current_count >= max_accounts:
@@ -2023,16 +2853,20 @@ def send_code():
         logger.error(f"Limit Check Error: {e}")
 
     # --- [FITUR LAMA AMAN]: Rate Limiting ---
-    current_time = time.time()
-    if user_id in login_states:
-        last_req = login_states[user_id].get('last_otp_req', 0)
-        if current_time - last_req < 60:
-            remaining = int(60 - (current_time - last_req))
-            return jsonify({'status': 'cooldown', 'message': f'Tunggu {remaining} detik lagi.'})
+    # Key OTP hidup OTP_COOLDOWN_SEC detik -> selama masih ada, user masih cooldown
+    remaining = state_store.ttl(_otp_key(user_id))
+    if remaining > 0:
+        return jsonify({'status': 'cooldown', 'message': f'Tunggu {remaining} detik lagi.'})
     
     async def _process_send_code():
+        key = (user_id, phone)
+        # Kirim ulang OTP -> client lama dibuang
+        old_client = _take_pending_client(key)
+        if old_client: await old_client.disconnect()
+
         client = TelegramClient(StringSession(), API_ID, API_HASH)
         await client.connect()
+        parked = False
         try:
             if not await client.is_user_authorized():
                 req = await client.send_code_request(phone)
@@ -2043,30 +2877,52 @@ def send_code():
                     'user_id': user_id,
                     'phone_number': phone,
                     'session_string': temp_session_str,
-                    'targets': req.phone_code_hash, # Hash OTP sementara
+                    'phone_code_hash': req.phone_code_hash, # Hash OTP sementara
+                    'login_state': 'pending_otp',
                     'is_active': False, # Belum aktif sampai verifikasi
                     'created_at': datetime.utcnow().isoformat()
                 }
                 
-                # Upsert ke Supabase
-                supabase.table('telegram_accounts').upsert(data, on_conflict="user_id, phone_number").execute()
+                # Nomor udah kebaca pas cek limit -> langsung UPDATE / INSERT, gak perlu resolusi konflik upsert
+                tbl = supabase.table('telegram_accounts')
+                if is_existing_number:
+                    del data['user_id'], data['phone_number']
+                    q = tbl.update(data).eq('user_id', user_id).eq('phone_number', phone)
+                elif is_existing_number is False:
+                    q = tbl.insert(data)
+                else:
+                    q = tbl.upsert(data, on_conflict="user_id, phone_number")
+                await asyncio.to_thread(q.execute)
                 
-                login_states[user_id] = {'last_otp_req': current_time, 'pending_phone': phone} # Simpan phone yg lagi login di RAM
-                return jsonify({'status': 'success', 'message': 'Kode OTP terkirim!'})
+                # Client dibiarin konek, nanti dipake verify_code
+                parked = _park_pending_client(key, client)
+                return {'status': 'success', 'message': 'Kode OTP terkirim!'}
             else:
-                return jsonify({'status': 'error', 'message': 'Nomor ini aneh (Authorized but not local).'})
+                return {'status': 'error', 'message': 'Nomor ini aneh (Authorized but not local).'}
         except Exception as e:
-            return jsonify({'status': 'error', 'message': f'Telegram Error: {str(e)}'})
-        finally: await client.disconnect()
+            return {'status': 'error', 'message': f'Telegram Error: {str(e)}'}
+        finally:
+            if not parked: await client.disconnect()
 
-    return run_async(_process_send_code())
+    # Jalan di loop Satpam (long-lived) biar client-nya masih hidup pas verify_code
+    try:
+        result = AutoReplyService.run(_process_send_code())
+    except FutureTimeoutError:
+        return jsonify({'status': 'error', 'message': 'Telegram Error: Timeout, coba lagi.'})
+    if result['status'] == 'success':
+        # Ditulis di thread Flask, bukan di coroutine: state_store bisa Redis (blocking) -> jangan nahan loop Satpam
+        state_store.setex(_otp_key(user_id), OTP_COOLDOWN_SEC, phone) # Simpan phone yg lagi login + mulai cooldown
+    return jsonify(result)
 
 @app.route('/api/connect/verify_code', methods=['POST'])
 @login_required
 def verify_code():
     user_id = session['user_id']
-    otp = request.json.get('otp')
-    pw = request.json.get('password')
+    data = get_json_body()
+    otp = data.get('otp')
+    pw = data.get('password')
+    
+    if not otp: return jsonify({'status': 'error', 'message': 'Kode OTP wajib diisi.'})
     
     # 1. Retrieve Stored Session & Hash
     db_session = None
@@ -2074,10 +2930,10 @@ def verify_code():
     db_phone = None
     
     try:
-        # Ambil sesi pending (yang belum aktif atau yang lagi proses)
-        # Prioritaskan cari berdasarkan phone number yang disimpan di RAM/Session jika ada, 
-        # tapi karena stateless, kita cari row yang punya hash tapi belum aktif.
-        res = supabase.table('telegram_accounts').select("*").eq('user_id', user_id).eq('is_active', False).neq('targets', '[]').limit(1).execute()
+        # Ambil sesi pending (OTP udah dikirim, belum diverifikasi) -> index parsial, lihat sql/telegram_accounts_login_state.sql
+        res = supabase.table('telegram_accounts').select("phone_number, session_string, phone_code_hash")\
+            .eq('user_id', user_id).eq('login_state', 'pending_otp').eq('is_active', False)\
+            .order('created_at', desc=True).limit(1).execute()
         
         if not res.data:
             return jsonify({'status': 'error', 'message': 'Sesi kadaluarsa. Kirim ulang OTP.'})
@@ -2085,25 +2941,30 @@ def verify_code():
         row = res.data[0]
         db_session = row['session_string']
         db_phone = row['phone_number']
-        db_hash = row['targets']
+        db_hash = row['phone_code_hash']
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Database Error: {str(e)}'})
 
     async def _process_verify():
-        client = TelegramClient(StringSession(db_session), API_ID, API_HASH)
-        await client.connect()
+        key = (user_id, db_phone)
+        # Pake client yang masih konek dari send_code; kalau gak ada, konek ulang dari session DB
+        client = _take_pending_client(key)
+        if client is None:
+            client = TelegramClient(StringSession(db_session), API_ID, API_HASH)
+            await client.connect()
+        parked = False
         
         try:
             # 2. Sign In
             try:
-                await client.sign_in(db_phone, otp, phone_code_hash=db_hash)
+                me = await client.sign_in(db_phone, otp, phone_code_hash=db_hash)
             except errors.SessionPasswordNeededError:
                 if not pw:
-                    return jsonify({'status': '2fa', 'message': 'Akun dilindungi 2FA. Masukkan Password.'})
-                await client.sign_in(password=pw)
+                    parked = _park_pending_client(key, client)
+                    return {'status': '2fa', 'message': 'Akun dilindungi 2FA. Masukkan Password.'}
+                me = await client.sign_in(password=pw)
             
-            # 3. [BARU] AMBIL DATA PROFIL TELEGRAM
-            me = await client.get_me()
+            # 3. [BARU] DATA PROFIL TELEGRAM -> udah dibalikin sign_in (User), gak perlu get_me lagi
             
             # 4. Simpan Session & Profil ke DB
             final_session = client.session.save()
@@ -2111,7 +2972,8 @@ def verify_code():
             update_data = {
                 'session_string': final_session,
                 'is_active': True,
-                'targets': '[]', # Clear hash
+                'phone_code_hash': None, # Clear hash
+                'login_state': 'active',
                 'created_at': datetime.utcnow().isoformat(),
                 # Simpan Info Profil
                 'first_name': me.first_name or '',
@@ -2119,20 +2981,26 @@ def verify_code():
                 'username': me.username or ''
             }
             
-            supabase.table('telegram_accounts').update(update_data).eq('user_id', user_id).eq('phone_number', db_phone).execute()
+            await asyncio.to_thread(lambda: supabase.table('telegram_accounts').update(update_data).eq('user_id', user_id).eq('phone_number', db_phone).execute())
+            AutoReplyService.request_reconcile()
+            invalidate_user_cache(user_id)
             
-            return jsonify({'status': 'success', 'message': f'Berhasil login sebagai {me.first_name}!'})
+            return {'status': 'success', 'message': f'Berhasil login sebagai {me.first_name}!'}
             
         except errors.PhoneCodeInvalidError:
-            return jsonify({'status': 'error', 'message': 'Kode OTP salah.'})
+            # OTP salah -> client disimpen lagi buat percobaan berikutnya
+            parked = _park_pending_client(key, client)
+            return {'status': 'error', 'message': 'Kode OTP salah.'}
         except Exception as e:
             logger.error(f"Login Failed: {e}")
-            return jsonify({'status': 'error', 'message': f'Gagal: {str(e)}'})
+            return {'status': 'error', 'message': f'Gagal: {str(e)}'}
         finally:
-            await client.disconnect()
+            if not parked: await client.disconnect()
 
     try:
-        return run_async(_process_verify())
+        return jsonify(AutoReplyService.run(_process_verify()))
+    except FutureTimeoutError:
+        return jsonify({'status': 'error', 'message': 'Gagal: Timeout, coba lagi.'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
@@ -2142,113 +3010,140 @@ def verify_code():
 
 # Global Memory untuk komunikasi antar-thread (Scan QR & Input Password)
 qr_states = {}
-
-def qr_worker(user_id, session_uuid):
-    print(f"THREAD [{session_uuid}]: Worker Started", flush=True)
+QR_FINAL_STATUSES = ('success', 'expired', 'error')
+QR_STATE_LINGER_SEC = 30  # Sesi yang udah kelar dibiarin sebentar biar polling/stream sempat baca hasil akhirnya
+
+def _drop_qr_state_later(session_uuid):
+    """Buang state sesi QR yang udah kelar setelah QR_STATE_LINGER_SEC (gak numpuk di memory)."""
+    timer = threading.Timer(QR_STATE_LINGER_SEC, qr_states.pop, args=(session_uuid, None))
+    timer.daemon = True
+    timer.start()
+
+def _get_qr_state(session_uuid, user_id):
+    """State sesi QR, cuma kalau sesi itu punya user yang lagi request (None kalau gak ada / punya orang lain)."""
+    state = qr_states.get(session_uuid) if session_uuid else None
+    if state is None or state.get('user_id') != user_id: return None
+    return state
+
+def _save_qr_account(user_id, me, session_string):
+    """Simpan akun hasil QR login ke DB (blocking -> dipanggil lewat asyncio.to_thread dari sesi QR)."""
+    db_data = {
+        'user_id': user_id,
+        'phone_number': f"+{me.phone}",
+        'session_string': session_string,
+        'first_name': me.first_name or '',
+        'last_name': me.last_name or '',
+        'username': me.username or '',
+        'is_active': True,
+        'login_state': 'active',
+        'phone_code_hash': None,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    supabase.table('telegram_accounts').upsert(db_data, on_conflict="user_id, phone_number").execute()
+    AutoReplyService.request_reconcile()
+    invalidate_user_cache(user_id)
+
+def _set_qr_status(session_uuid, status, **fields):
+    """Ganti status sesi QR + bangunin semua stream /qr_stream yang lagi nunggu perubahan."""
+    state = qr_states.get(session_uuid)
+    if state is None: return
+    with state['status_changed']:
+        state.update(fields)
+        state['status'] = status
+        state['version'] += 1
+        state['status_changed'].notify_all()
+
+async def qr_login_session(user_id, session_uuid):
+    """1 sesi QR login = 1 coroutine di loop Satpam (bukan 1 thread + 1 event loop baru per sesi)."""
+    print(f"QR [{session_uuid}]: Session Started", flush=True)
+    ready = qr_states[session_uuid]['ready']  # Dipegang dari awal biar finally gak perlu baca qr_states lagi
     
-    async def _process():
-        # Bikin koneksi baru khusus sesi ini
-        client = TelegramClient(StringSession(), API_ID, API_HASH)
-        await client.connect()
-        
-        try:
-            if not await client.is_user_authorized():
-                # 1. Request QR Token
-                qr_login = await client.qr_login()
-                qr_states[session_uuid]['qr_url'] = qr_login.url
-                qr_states[session_uuid]['status'] = 'waiting'
+    # Bikin koneksi baru khusus sesi ini
+    client = TelegramClient(StringSession(), API_ID, API_HASH)
+    await client.connect()
+    
+    try:
+        if not await client.is_user_authorized():
+            # 1. Request QR Token
+            qr_login = await client.qr_login()
+            qr_states[session_uuid]['qr_url'] = qr_login.url
+            _set_qr_status(session_uuid, 'waiting')
+            ready.set()  # Bangunin get_qr_code yang lagi nunggu URL
+            
+            try:
+                # 2. TUNGGU USER SCAN DI HP
+                # Timeout 120 detik biar user gak buru-buru
+                print(f"QR [{session_uuid}]: Waiting scan...", flush=True)
+                
+                # 3. SCAN BERHASIL -> wait() langsung balikin User yang login.
+                # Jika user pake 2FA, wait() yang melempar SessionPasswordNeededError.
                 
                 try:
-                    # 2. TUNGGU USER SCAN DI HP
-                    # Timeout 120 detik biar user gak buru-buru
-                    print(f"THREAD [{session_uuid}]: Waiting scan...", flush=True)
-                    await qr_login.wait(timeout=120)
+                    me = await qr_login.wait(timeout=120)
                     
-                    # 3. SCAN BERHASIL -> Cek apakah butuh password 2FA?
-                    # Kita coba panggil get_me(). 
-                    # Jika user pake 2FA, method ini bakal gagal & melempar error.
+                    # --- FLOW A: LOGIN LANGSUNG (TANPA 2FA) ---
+                    # Simpan DB di sini (bukan di /check_qr / stream) -> pembaca status cuma baca state
+                    await asyncio.to_thread(_save_qr_account, user_id, me, client.session.save())
+                    _set_qr_status(session_uuid, 'success', first_name=me.first_name)
+                    print(f"QR [{session_uuid}]: Login Success (No 2FA)", flush=True)
                     
+                except errors.SessionPasswordNeededError:
+                    # --- FLOW B: BUTUH PASSWORD (2FA DETECTED) ---
+                    print(f"QR [{session_uuid}]: 2FA REQUIRED!", flush=True)
+                    
+                    # Event dipasang DULU sebelum status 2fa_required, biar /submit_2fa bisa langsung bangunin worker
+                    pw_event = asyncio.Event()
+                    qr_states[session_uuid]['loop'] = asyncio.get_running_loop()
+                    qr_states[session_uuid]['pw_event'] = pw_event
+                    
+                    # Update status biar frontend tau harus minta password
+                    _set_qr_status(session_uuid, '2fa_required')
+                    
+                    # TUNGGU PASSWORD DARI FRONTEND (Maks 120 detik), tanpa polling
                     try:
-                        me = await client.get_me()
-                        
-                        # --- FLOW A: LOGIN LANGSUNG (TANPA 2FA) ---
-                        final_session = client.session.save()
-                        qr_states[session_uuid]['user_data'] = {
-                            'session': final_session,
-                            'phone': f"+{me.phone}",
-                            'first_name': me.first_name,
-                            'last_name': me.last_name,
-                            'username': me.username
-                        }
-                        qr_states[session_uuid]['status'] = 'success'
-                        print(f"THREAD [{session_uuid}]: Login Success (No 2FA)", flush=True)
-                        
-                    except errors.SessionPasswordNeededError:
-                        # --- FLOW B: BUTUH PASSWORD (2FA DETECTED) ---
-                        print(f"THREAD [{session_uuid}]: 2FA REQUIRED!", flush=True)
-                        
-                        # Update status biar frontend tau harus minta password
-                        qr_states[session_uuid]['status'] = '2fa_required'
-                        
-                        # TUNGGU PASSWORD DARI FRONTEND (Maks 120 detik)
-                        password_received = False
-                        for _ in range(240): # 240 x 0.5s = 120 detik
-                            # Cek apakah password udah dikirim via API /submit_2fa
-                            if 'password_input' in qr_states[session_uuid]:
-                                pw = qr_states[session_uuid]['password_input']
-                                try:
-                                    # Coba login pake password
-                                    await client.sign_in(password=pw)
-                                    
-                                    # Kalau tembus sini, berarti password BENAR!
-                                    me = await client.get_me()
-                                    final_session = client.session.save()
-                                    
-                                    qr_states[session_uuid]['user_data'] = {
-                                        'session': final_session,
-                                        'phone': f"+{me.phone}",
-                                        'first_name': me.first_name,
-                                        'last_name': me.last_name,
-                                        'username': me.username
-                                    }
-                                    qr_states[session_uuid]['status'] = 'success'
-                                    password_received = True
-                                    print(f"THREAD [{session_uuid}]: Login Success (With 2FA)", flush=True)
-                                    break
-                                    
-                                except Exception as pw_e:
-                                    # Password Salah
-                                    print(f"THREAD [{session_uuid}]: Wrong Password: {pw_e}", flush=True)
-                                    qr_states[session_uuid]['status'] = 'error'
-                                    qr_states[session_uuid]['error_msg'] = "Password Salah!"
-                                    password_received = True # Biar loop berhenti
-                                    break
-                                    
-                            await asyncio.sleep(0.5)
+                        if 'password_input' not in qr_states[session_uuid]:
+                            await asyncio.wait_for(pw_event.wait(), timeout=120)
+                    except asyncio.TimeoutError:
+                        _set_qr_status(session_uuid, 'expired')
+                    else:
+                        pw = qr_states[session_uuid]['password_input']
+                        try:
+                            # Coba login pake password
+                            # Kalau tembus sini, berarti password BENAR! (sign_in balikin User, gak perlu get_me lagi)
+                            me = await client.sign_in(password=pw)
+                        except Exception as pw_e:
+                            # Password Salah
+                            print(f"QR [{session_uuid}]: Wrong Password: {pw_e}", flush=True)
+                            _set_qr_status(session_uuid, 'error', error_msg="Password Salah!")
+                        else:
+                            await asyncio.to_thread(_save_qr_account, user_id, me, client.session.save())
+                            _set_qr_status(session_uuid, 'success', first_name=me.first_name)
+                            print(f"QR [{session_uuid}]: Login Success (With 2FA)", flush=True)
                         
-                        if not password_received:
-                            qr_states[session_uuid]['status'] = 'expired'
-                            
-                except asyncio.TimeoutError:
-                    qr_states[session_uuid]['status'] = 'expired'
-            else:
-                qr_states[session_uuid]['status'] = 'error'
-                qr_states[session_uuid]['error_msg'] = "Client already auth?"
-                
-        except Exception as e:
-            # Handle error umum
-            err = str(e)
-            print(f"THREAD [{session_uuid}]: CRITICAL ERROR: {err}", flush=True)
-            qr_states[session_uuid]['status'] = 'error'
-            qr_states[session_uuid]['error_msg'] = err
-        finally:
-            await client.disconnect()
+            except asyncio.TimeoutError:
+                _set_qr_status(session_uuid, 'expired')
+        else:
+            _set_qr_status(session_uuid, 'error', error_msg="Client already auth?")
+            
+    except Exception as e:
+        # Handle error umum
+        err = str(e)
+        print(f"QR [{session_uuid}]: CRITICAL ERROR: {err}", flush=True)
+        _set_qr_status(session_uuid, 'error', error_msg=err)
+    finally:
+        # Gagal sebelum dapet URL -> get_qr_code gak usah nunggu sampai timeout
+        ready.set()
+        state = qr_states.get(session_uuid)
+        if state is not None and state['status'] not in QR_FINAL_STATUSES:
+            # Coroutine dibatalin (loop Satpam mati) -> stream yang nunggu langsung dikasih tau
+            _set_qr_status(session_uuid, 'expired')
+        if state is not None:
+            _drop_qr_state_later(session_uuid)
+        await client.disconnect()
 
-    # Jalankan Loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(_process())
-    loop.close()
+def qr_worker(user_id, session_uuid):
+    """Fallback kalau loop Satpam belum nyala: sesi QR jalan di thread + loop sendiri."""
+    asyncio.run(qr_login_session(user_id, session_uuid))
 
 # --- ROUTE 1: MINTA QR (SAMA KAYAK SEBELUMNYA) ---
 @app.route('/api/connect/get_qr', methods=['POST'])
@@ -2281,23 +3176,24 @@ def get_qr_code():
     except Exception as e: 
         logger.error(f"Limit Check QR Error: {e}")
 
-    # --- [FITUR LAMA AMAN]: Generate QR Code & Thread Worker ---
+    # --- [FITUR LAMA AMAN]: Generate QR Code & Sesi Login ---
     session_uuid = str(uuid.uuid4())
-    qr_states[session_uuid] = {'status': 'initializing', 'qr_url': None}
+    # pw_event + loop diisi worker pas 2FA kedeteksi (Event harus nempel ke loop worker)
+    # ready di-set worker begitu URL QR ada (atau sesi gagal duluan)
+    # status_changed + version: dipake _set_qr_status buat nge-push perubahan status ke /qr_stream
+    # user_id: pemilik sesi, dicek tiap /submit_2fa, /check_qr & /qr_stream
+    qr_states[session_uuid] = {'user_id': user_id, 'status': 'initializing', 'qr_url': None, 'pw_event': None, 'loop': None,
+                               'ready': threading.Event(), 'status_changed': threading.Condition(), 'version': 0}
     
-    # Start Background Thread
-    t = threading.Thread(target=qr_worker, args=(user_id, session_uuid))
-    t.daemon = True
-    t.start()
+    # Jalanin sesi di loop Satpam; fallback ke thread sendiri (state dibersihin sendiri sama sesinya)
+    if not AutoReplyService.submit(qr_login_session(user_id, session_uuid)):
+        threading.Thread(target=qr_worker, args=(user_id, session_uuid), daemon=True).start()
     
-    # Tunggu sebentar (Max 5 detik)
-    import time
-    for _ in range(50):
-        if qr_states[session_uuid].get('qr_url'): break
-        time.sleep(0.1)
+    # Tunggu sebentar (Max 5 detik), bangun begitu worker nge-set ready
+    qr_states[session_uuid]['ready'].wait(timeout=5.0)
         
     if not qr_states[session_uuid].get('qr_url'):
-        return jsonify({'status': 'error', 'message': 'Timeout koneksi Telegram.'})
+        return jsonify({'status': 'error', 'message': qr_states[session_uuid].get('error_msg') or 'Timeout koneksi Telegram.'})
         
     # Generate Image
     url = qr_states[session_uuid]['qr_url']
@@ -2319,9 +3215,14 @@ def submit_2fa_qr():
     session_uuid = request.json.get('session_uuid')
     password = request.json.get('password')
     
-    if session_uuid in qr_states:
-        # Masukkan password ke memory agar diambil oleh Thread Worker
-        qr_states[session_uuid]['password_input'] = password
+    state = _get_qr_state(session_uuid, session['user_id'])
+    if state is not None:
+        # Masukkan password ke memory agar diambil oleh sesi QR, lalu bangunin sesinya
+        state['password_input'] = password
+        pw_event, loop = state.get('pw_event'), state.get('loop')
+        if pw_event and loop:
+            try: loop.call_soon_threadsafe(pw_event.set)
+            except RuntimeError: pass  # Loop worker udah ditutup (sesi kelar)
         return jsonify({'status': 'success'})
     
     return jsonify({'status': 'error', 'message': 'Sesi QR hilang/kadaluarsa'})
@@ -2331,42 +3232,62 @@ def submit_2fa_qr():
 @login_required
 def check_qr_status():
     session_uuid = request.json.get('session_uuid')
-    user_id = session['user_id']
-    
-    if not session_uuid or session_uuid not in qr_states:
-        return jsonify({'status': 'expired', 'message': 'QR Expired.'})
+    return jsonify(qr_status_payload(session['user_id'], session_uuid))
+
+def qr_status_payload(user_id, session_uuid):
+    """Status sesi QR versi frontend (dipake polling /check_qr & stream /qr_stream). Cuma baca state, akun udah disimpan sesinya."""
+    state = _get_qr_state(session_uuid, user_id)
+    if state is None:
+        return {'status': 'expired', 'message': 'QR Expired.'}
     
-    state = qr_states[session_uuid]
     status = state.get('status')
     
     if status == 'success':
-        # Login Sukses -> Simpan DB
-        u_data = state['user_data']
-        db_data = {
-            'user_id': user_id,
-            'phone_number': u_data['phone'],
-            'session_string': u_data['session'],
-            'first_name': u_data['first_name'] or '',
-            'last_name': u_data['last_name'] or '',
-            'username': u_data['username'] or '',
-            'is_active': True,
-            'targets': '[]',
-            'created_at': datetime.utcnow().isoformat()
-        }
-        supabase.table('telegram_accounts').upsert(db_data, on_conflict="user_id, phone_number").execute()
-        del qr_states[session_uuid]
-        return jsonify({'status': 'success', 'message': f"Login Berhasil: {u_data['first_name']}"})
+        return {'status': 'success', 'message': f"Login Berhasil: {state.get('first_name')}"}
         
     elif status == '2fa_required':
         # Kasih tau frontend buat munculin prompt password
-        return jsonify({'status': '2fa'})
+        return {'status': '2fa'}
         
     elif status == 'expired':
-        return jsonify({'status': 'expired'})
+        return {'status': 'expired'}
     elif status == 'error':
-        return jsonify({'status': 'error', 'message': state.get('error_msg', 'Unknown Error')})
+        return {'status': 'error', 'message': state.get('error_msg', 'Unknown Error')}
     else:
-        return jsonify({'status': 'waiting'})
+        return {'status': 'waiting'}
+
+# --- ROUTE 4: STREAM STATUS (SSE) -> ganti polling check_qr tiap 2 detik ---
+QR_STREAM_MAX_SEC = 300   # QR 120 detik + 2FA 120 detik + napas
+QR_STREAM_PING_SEC = 25   # Keep-alive biar proxy gak motong koneksi yang lagi diem
+
+@app.route('/api/connect/qr_stream/<session_uuid>')
+@login_required
+def qr_status_stream(session_uuid):
+    user_id = session['user_id']
+
+    def generate():
+        deadline = time.monotonic() + QR_STREAM_MAX_SEC
+        seen_version = -1
+        last_status = None
+        while time.monotonic() < deadline:
+            state = _get_qr_state(session_uuid, user_id)
+            if state is not None:
+                seen_version = state['version']
+            payload = qr_status_payload(user_id, session_uuid)
+            if payload['status'] != last_status:
+                last_status = payload['status']
+                yield f"data: {app.json.dumps(payload)}\n\n"
+            if last_status in QR_FINAL_STATUSES or state is None:
+                return
+            # Tidur sampai worker ganti status (version naik) atau waktunya ping
+            with state['status_changed']:
+                changed = state['status_changed'].wait_for(lambda: state['version'] != seen_version, timeout=QR_STREAM_PING_SEC)
+            if not changed:
+                yield ": ping\n\n"
+        yield f"data: {app.json.dumps({'status': 'expired'})}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # ==============================================================================
 # SECTION 10: BOT FEATURES API (SCAN, TARGETS, IMPORT)
@@ -2580,7 +3501,7 @@ def save_bulk_targets():
                 'user_id': user,
                 'group_name': t['group_name'],
                 'group_id': str(t['group_id']),
-                'topic_ids': ",".join(map(str, t['topic_ids'])) if t.get('topic_ids') else None,
+                'topic_ids': normalize_topic_ids(t.get('topic_ids')),
                 'created_at': datetime.now().isoformat(),
                 'source_phone': source_phone,
                 'source_name': source_name,
@@ -2838,7 +3759,7 @@ def import_targets_csv():
             if gid:
                 valid_rows.append({
                     "user_id": user_id, "group_id": str(gid).strip(), "group_name": gname.strip(),
-                    "topic_ids": topics.strip() if topics else None, "source_phone": source_phone,
+                    "topic_ids": normalize_topic_ids(topics), "source_phone": source_phone,
                     "template_name": template_name, "created_at": datetime.utcnow().isoformat()
                 })
         if valid_rows:
@@ -2895,34 +3816,41 @@ def fetch_telegram_message():
     link = request.json.get('link')
     if not link: return jsonify({'status': 'error', 'message': 'Link kosong.'})
 
+    # Jalan di loop Satpam: kalau akun user lagi didengerin Satpam, client-nya dipinjem (tanpa handshake MTProto baru)
     async def _fetch():
-        client = await get_active_client(user_id)
-        if not client: return jsonify({'status': 'error', 'message': 'Telegram disconnected.'})
+        client = AutoReplyService.get_connected_client(user_id)
+        borrowed = client is not None
+        if not borrowed: client = await get_active_client(user_id)
+        if not client: return {'status': 'error', 'message': 'Telegram disconnected.'}
         try:
             entity, msg_id = parse_telegram_link(link)
-            if not entity or not msg_id: return jsonify({'status': 'error', 'message': 'Link tidak valid.'})
+            if not entity or not msg_id: return {'status': 'error', 'message': 'Link tidak valid.'}
             msg = await client.get_messages(entity, ids=msg_id)
-            if not msg: return jsonify({'status': 'error', 'message': 'Pesan tidak ditemukan.'})
-            return jsonify({
+            if not msg: return {'status': 'error', 'message': 'Pesan tidak ditemukan.'}
+            return {
                 'status': 'success', 'text': msg.text or "", 
                 'has_media': True if msg.media else False,
                 'source_chat_id': str(utils.get_peer_id(msg.peer_id)), 'source_message_id': msg.id
-            })
-        except Exception as e: return jsonify({'status': 'error', 'message': str(e)})
-        finally: await client.disconnect()
+            }
+        except Exception as e: return {'status': 'error', 'message': str(e)}
+        finally:
+            # Client pinjeman punya Satpam, jangan diputus
+            if not borrowed: await client.disconnect()
         
-    return run_async(_fetch())
+    try:
+        return jsonify(AutoReplyService.run(_fetch()))
+    except FutureTimeoutError:
+        return jsonify({'status': 'error', 'message': 'Timeout ambil pesan, coba lagi.'})
 
 # ==============================================================================
 # SECTION 11: BROADCAST SYSTEM (REAL-TIME STREAMING & HUMAN MODE)
 # ==============================================================================
 
-# Global State buat kontrol Stop/Pause
-broadcast_states = {}
-
 def process_spintax(text):
     import re
     if not text: return ""
+    # Fast-path: mayoritas template gak pake spintax, gak usah nyalain regex sama sekali
+    if '{' not in text: return text
     pattern = r'\{([^{}]+)\}'
     while True:
         match = re.search(pattern, text)
@@ -2941,7 +3869,7 @@ def start_broadcast():
     [UPGRADE KASTA DEWA]: Premium Emoji Support (Clone Mode) & Anti-Crash.
     """
     user_id = session['user_id']
-    broadcast_states[user_id] = 'running'
+    state_store.setex(_broadcast_key(user_id), BROADCAST_STATE_TTL, 'running')
 
     # Tangkap Input
     message_raw = request.form.get('message')
@@ -2994,7 +3922,10 @@ def start_broadcast():
 
     # GENERATOR FUNCTION (STREAMING)
     def generate():
-        yield json.dumps({"type": "start", "total": len(targets)}) + "\n"
+        total = len(targets)
+        # Bagian JSON yang konstan sepanjang loop diserialisasi sekali aja
+        progress_prefix = f'{{"type": "progress", "total": {total}, '
+        yield json.dumps({"type": "start", "total": total}) + "\n"
         
         async def _engine():
             client = None
@@ -3031,21 +3962,21 @@ def start_broadcast():
                 
                 for idx, user in enumerate(targets):
                     
-                    if broadcast_states.get(user_id) == 'stopped':
+                    if is_broadcast_stopped(user_id):
                         yield json.dumps({"type": "error", "msg": "⛔ Broadcast Dihentikan Paksa."}) + "\n"
                         break
 
                     if idx > 0 and idx % 40 == 0:
                         rest_time = random.randint(120, 240)
                         yield json.dumps({
-                            "type": "progress", "current": idx, "total": len(targets),
+                            "type": "progress", "current": idx, "total": total,
                             "status": "warning", "log": f"☕ Istirahat {rest_time}s (Mencegah Limit)...",
                             "success": success_count, "failed": fail_count
                         }) + "\n"
                         
                         # Anti-Timeout Heartbeat
                         for _ in range(rest_time):
-                            if broadcast_states.get(user_id) == 'stopped': break
+                            if is_broadcast_stopped(user_id): break
                             await asyncio.sleep(1)
                             yield " \n" 
 
@@ -3114,7 +4045,7 @@ def start_broadcast():
                             yield json.dumps({"type": "progress", "log": f"⏳ Telegram limit, istirahat {wait_sec}s...", "status": "warning"}) + "\n"
                             
                             for _ in range(wait_sec):
-                                if broadcast_states.get(user_id) == 'stopped': break
+                                if is_broadcast_stopped(user_id): break
                                 await asyncio.sleep(1)
                                 yield " \n"
                         else:
@@ -3122,30 +4053,29 @@ def start_broadcast():
 
                     # 4. LOGGING & UPDATE UI
                     try:
-                        supabase.table('blast_logs').insert({
+                        log_row = {
                             "user_id": user_id,
                             "group_name": f"{u_name} (User)",
                             "group_id": str(t_id),
                             "status": log_status,
                             "error_message": error_msg,
                             "created_at": datetime.utcnow().isoformat()
-                        }).execute()
+                        }
+                        # Lempar ke thread pool biar HTTP Supabase gak nge-block event loop Telethon
+                        await asyncio.get_running_loop().run_in_executor(
+                            _BLAST_LOG_POOL, lambda: supabase.table('blast_logs').insert(log_row).execute()
+                        )
                     except: pass 
 
-                    yield json.dumps({
-                        "type": "progress",
-                        "current": idx + 1,
-                        "total": len(targets),
-                        "status": ui_status,
-                        "log": ui_log,
-                        "success": success_count,
-                        "failed": fail_count
-                    }) + "\n"
+                    yield (
+                        f'{progress_prefix}"current": {idx + 1}, "status": "{ui_status}", '
+                        f'"log": {json.dumps(ui_log)}, "success": {success_count}, "failed": {fail_count}}}\n'
+                    )
 
                     # 5. JEDA ANTAR PESAN (Anti-Timeout Heartbeat)
                     delay = random.uniform(5.0, 12.0)
                     for _ in range(int(delay)):
-                        if broadcast_states.get(user_id) == 'stopped': break
+                        if is_broadcast_stopped(user_id): break
                         await asyncio.sleep(1)
                         yield " \n" 
 
@@ -3169,10 +4099,7 @@ def start_broadcast():
                         f"─────────────────\n"
                         f"_Cek Log di Dashboard untuk detail error._"
                     )
-                    threading.Thread(
-                        target=send_telegram_alert, 
-                        args=(user_id, report_msg, True)
-                    ).start()
+                    _NOTIF_POOL.submit(send_telegram_alert, user_id, report_msg, True)
 
                 yield json.dumps({"type": "done", "success": success_count, "failed": fail_count}) + "\n"
 
@@ -3187,7 +4114,7 @@ def start_broadcast():
                     break
         except GeneratorExit:
             logger.warning(f"Client disconnected during broadcast (User: {user_id}).")
-            broadcast_states[user_id] = 'stopped'
+            state_store.setex(_broadcast_key(user_id), BROADCAST_STATE_TTL, 'stopped')
         finally:
             loop.run_until_complete(runner.aclose())
             loop.close()
@@ -3231,6 +4158,7 @@ def edit_schedule():
         # Eksekusi update ke database Supabase
         if schedule_id:
             supabase.table('blast_schedules').update(update_data).eq('id', schedule_id).eq('user_id', session['user_id']).execute()
+            SchedulerWorker.invalidate_index()
             flash('Jadwal berhasil diperbarui!', 'success')
         else:
             flash('ID Jadwal tidak ditemukan.', 'danger')
@@ -3266,6 +4194,7 @@ def update_schedule():
                 .eq('id', schedule_id)\
                 .eq('user_id', session['user_id'])\
                 .execute()
+            SchedulerWorker.invalidate_index()
             flash('✅ Jadwal berhasil di-update!', 'success')
         else:
             flash('❌ ID Jadwal tidak valid.', 'danger')
@@ -3346,6 +4275,7 @@ def add_schedule():
 
         # Simpan ke DB (Cuma 1 baris, gak bakal double!)
         supabase.table('blast_schedules').insert(data).execute()
+        SchedulerWorker.invalidate_index()
         flash('✅ Jadwal berhasil disimpan dan target terkunci!', 'success')
         
     except Exception as e:
@@ -3359,6 +4289,7 @@ def add_schedule():
 def delete_schedule(id):
     try:
         supabase.table('blast_schedules').delete().eq('id', id).eq('user_id', session['user_id']).execute()
+        SchedulerWorker.invalidate_index()
         flash('Jadwal dihapus.', 'success')
     except:
         flash('Gagal menghapus jadwal.', 'danger')
@@ -3451,6 +4382,7 @@ def update_template():
         
         # Eksekusi Update ke Database
         supabase.table('message_templates').update(data).eq('id', t_id).eq('user_id', user_id).execute()
+        MessageTemplateManager.invalidate_templates(user_id)
         
         flash('Template berhasil diperbarui!', 'success')
     except Exception as e:
@@ -3624,6 +4556,7 @@ def edit_keyword_route():
                 'keyword': new_keyword.lower(),
                 'response': new_response
             }).eq('id', rule_id).eq('user_id', session['user_id']).execute()
+            AutoReplyManager.invalidate_keywords(session['user_id'])
             flash('Keyword berhasil diupdate!', 'success')
             
     except Exception as e:
@@ -3745,21 +4678,25 @@ def super_admin_users():
 def super_admin_user_detail(user_id):
     """Halaman detail untuk kontrol penuh satu user"""
     try:
+        # 4 query ini gak saling bergantung -> tembak barengan biar latency = RTT paling lambat
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            f_u = ex.submit(lambda: supabase.table('users').select("*").eq('id', user_id).execute())
+            f_t = ex.submit(lambda: supabase.table('telegram_accounts').select("*").eq('user_id', user_id).execute())
+            f_l = ex.submit(lambda: supabase.table('blast_logs').select("*").eq('user_id', user_id).order('created_at', desc=True).limit(20).execute())
+            f_s = ex.submit(lambda: supabase.table('blast_schedules').select("id", count='exact').eq('user_id', user_id).eq('is_active', True).execute())
+            u_res, t_res, logs_res, sched_res = f_u.result(), f_t.result(), f_l.result(), f_s.result()
+
         # Ambil Data User
-        u_res = supabase.table('users').select("*").eq('id', user_id).execute()
         if not u_res.data: return "User not found"
         user = u_res.data[0]
         
         # Ambil Data Telegram
-        t_res = supabase.table('telegram_accounts').select("*").eq('user_id', user_id).execute()
         tele = t_res.data[0] if t_res.data else None
         
         # Ambil Statistik Blast
-        logs_res = supabase.table('blast_logs').select("*").eq('user_id', user_id).order('created_at', desc=True).limit(20).execute()
         logs = logs_res.data if logs_res.data else []
         
         # Ambil Statistik Jadwal
-        sched_res = supabase.table('blast_schedules').select("id", count='exact').eq('user_id', user_id).eq('is_active', True).execute()
         active_schedules = sched_res.count or 0
 
         return render_template('admin/user_detail.html', 
@@ -3786,6 +4723,7 @@ def super_admin_update_plan(user_id):
             'plan_tier': plan,
             'subscription_end': new_expiry
         }).eq('id', user_id).execute()
+        invalidate_user_cache(user_id)
         
         flash(f"Berhasil update user #{user_id} ke paket {plan} ({days} hari).", 'success')
     except Exception as e:
@@ -3804,6 +4742,8 @@ def super_admin_reset_session(user_id):
             'is_active': False,
             'session_string': None # Opsional: Hapus session string biar bersih total
         }).eq('user_id', user_id).execute()
+        AutoReplyService.request_reconcile()
+        invalidate_user_cache(user_id)
         
         flash(f"Sesi Telegram User #{user_id} berhasil di-reset paksa.", 'warning')
     except Exception as e:
@@ -3852,9 +4792,11 @@ def ban_user(user_id):
         
         new_val = not u_data[0].get('is_banned', False)
         supabase.table('users').update({'is_banned': new_val}).eq('id', user_id).execute()
+        invalidate_user_cache(user_id)
         
         if new_val:
             supabase.table('telegram_accounts').update({'is_active': False}).eq('user_id', user_id).execute()
+            AutoReplyService.request_reconcile()
             
         flash(f"Status User #{user_id} berhasil diubah.", 'success')
     except Exception as e:
@@ -3902,6 +4844,9 @@ def super_admin_pricing():
                 }).eq('id', var_id).execute()
                 
                 flash('Harga & Diskon berhasil diupdate!', 'success')
+
+            # Harga/fitur berubah -> landing & payment page harus ambil data baru
+            FinanceManager.invalidate_plans_cache()
                 
             return redirect(url_for('super_admin_pricing'))
 
@@ -3999,6 +4944,7 @@ def save_admin_bank():
             data['balance'] = 0
             supabase.table('admin_banks').insert(data).execute()
             flash('✅ Rekening baru berhasil ditambahkan.', 'success')
+        FinanceManager.invalidate_banks_cache()
             
     except Exception as e:
         logger.error(f"Save Bank Error: {e}")
@@ -4058,6 +5004,7 @@ def toggle_admin_bank(bank_id):
         if b_data:
             new_val = not b_data[0].get('is_active', False)
             supabase.table('admin_banks').update({'is_active': new_val}).eq('id', bank_id).execute()
+            FinanceManager.invalidate_banks_cache()
             flash('✅ Status rekening diubah.', 'success')
     except:
         flash('❌ Gagal merubah status.', 'danger')
@@ -4144,17 +5091,78 @@ def super_admin_mutations():
 # ==============================================================================
 # SECTION 13.5: FINANCE & PRICING MANAGER
 # ==============================================================================
+
+# Cache struktur harga (jarang berubah, tapi dibaca tiap buka landing/payment page)
+PLANS_CACHE_TTL = 300
+_PLANS_CACHE = {'data': None, 'json': None, 'exp': 0}
+_PLANS_CACHE_LOCK = threading.Lock()
+
+# Cache rekening bank aktif buat halaman payment (cuma berubah kalau admin edit / toggle rekening)
+BANKS_CACHE_TTL = 300
+_BANKS_CACHE = {'data': None, 'exp': 0}
+_BANKS_CACHE_LOCK = threading.Lock()
+
 class FinanceManager:
+    @staticmethod
+    def invalidate_plans_cache():
+        """Buang cache harga. Wajib dipanggil setiap admin ngubah pricing_plans / pricing_variants."""
+        with _PLANS_CACHE_LOCK:
+            _PLANS_CACHE['data'] = None
+            _PLANS_CACHE['json'] = None
+            _PLANS_CACHE['exp'] = 0
+
+    @staticmethod
+    def invalidate_banks_cache():
+        """Buang cache rekening. Wajib dipanggil setiap admin nambah / edit / toggle admin_banks."""
+        with _BANKS_CACHE_LOCK:
+            _BANKS_CACHE['data'] = None
+            _BANKS_CACHE['exp'] = 0
+
+    @staticmethod
+    def get_plans_json():
+        """Struktur harga versi string JSON (buat di-embed ke JS), di-encode sekali per umur cache"""
+        plans = FinanceManager.get_plans_structure()
+        with _PLANS_CACHE_LOCK:
+            if _PLANS_CACHE['data'] is plans and _PLANS_CACHE['json'] is not None:
+                return _PLANS_CACHE['json']
+        encoded = app.json.dumps(plans)
+        with _PLANS_CACHE_LOCK:
+            if _PLANS_CACHE['data'] is plans:
+                _PLANS_CACHE['json'] = encoded
+        return encoded
+
+    @staticmethod
+    def get_active_banks():
+        """Rekening tujuan transfer yang aktif (kolom yang ditampilin ke user aja, tanpa saldo)"""
+        if not supabase: return []
+
+        with _BANKS_CACHE_LOCK:
+            if _BANKS_CACHE['data'] is not None and time.time() < _BANKS_CACHE['exp']:
+                return _BANKS_CACHE['data']
+
+        banks = supabase.table('admin_banks').select("id, bank_name, account_number, account_holder")\
+            .eq('is_active', True).order('id').execute().data or []
+
+        with _BANKS_CACHE_LOCK:
+            _BANKS_CACHE['data'] = banks
+            _BANKS_CACHE['exp'] = time.time() + BANKS_CACHE_TTL
+        return banks
+
     @staticmethod
     def get_plans_structure():
         """Mengambil struktur lengkap Plan + Varian untuk Frontend + Kalkulasi Diskon Otomatis"""
         if not supabase: return {}
+
+        with _PLANS_CACHE_LOCK:
+            if _PLANS_CACHE['data'] is not None and time.time() < _PLANS_CACHE['exp']:
+                return _PLANS_CACHE['data']
         
-        plans = supabase.table('pricing_plans').select("*").order('id').execute().data
+        # Plan + Varian ditarik sekali jalan (embedded select via FK pricing_variants.plan_id)
+        plans = supabase.table('pricing_plans').select("*, pricing_variants(*)").order('id').execute().data
         structured_data = {}
         
         for p in plans:
-            variants = supabase.table('pricing_variants').select("*").eq('plan_id', p['id']).order('duration_days').execute().data
+            variants = sorted(p.get('pricing_variants') or [], key=lambda v: v['duration_days'])
             structured_data[p['code_name']] = []
             
             for v in variants:
@@ -4197,6 +5205,11 @@ class FinanceManager:
                     'btnText': "Pilih Paket",
                     'bestValue': v.get('is_best_value', False)
                 })
+
+        with _PLANS_CACHE_LOCK:
+            _PLANS_CACHE['data'] = structured_data
+            _PLANS_CACHE['json'] = None
+            _PLANS_CACHE['exp'] = time.time() + PLANS_CACHE_TTL
         return structured_data
 
     @staticmethod
@@ -4231,77 +5244,105 @@ class FinanceManager:
     def approve_transaction(trx_id, admin_id):
         """Admin Acc Pembayaran -> Perpanjang user & UPDATE SALDO BANK"""
         try:
-            # 1. Ambil Data Transaksi & Varian Paket
-            trx = supabase.table('transactions').select("*, pricing_variants(*, pricing_plans(display_name))")\
-                .eq('id', trx_id).single().execute().data
-            
-            if not trx: return False, "Transaksi tidak ditemukan"
-            if trx.get('status') == 'paid': return False, "Transaksi ini sudah pernah di-approve sebelumnya!"
-            
-            user_id = trx['user_id']
-            duration = trx['pricing_variants']['duration_days']
-            plan_name = trx['pricing_variants']['pricing_plans']['display_name']
-            amount = float(trx['amount'])
-            payment_method = trx.get('payment_method', '')
-            
-            # 2. Hitung Expired Baru
-            u_res = supabase.table('users').select("subscription_end").eq('id', user_id).single().execute()
-            current_end = u_res.data.get('subscription_end')
-            
-            now = datetime.utcnow()
-            if current_end:
-                current_date = datetime.fromisoformat(current_end.replace('Z', ''))
-                start_date = current_date if current_date > now else now
-            else:
-                start_date = now
-                
-            new_expiry = (start_date + timedelta(days=duration)).isoformat()
-            
-            # 3. Update Status User
-            supabase.table('users').update({
-                'plan_tier': plan_name,
-                'subscription_end': new_expiry
-            }).eq('id', user_id).execute()
-            
-            # 4. Update Transaksi jadi PAID
-            supabase.table('transactions').update({
-                'status': 'paid',
-                'admin_note': f"Approved by Admin #{admin_id} at {now}"
-            }).eq('id', trx_id).execute()
-            
-            # 5. [FITUR BARU]: UPDATE SALDO BANK OTOMATIS 💰
-            if payment_method:
-                bank_res = supabase.table('admin_banks').select("id, balance").ilike('bank_name', f"%{payment_method}%").limit(1).execute()
-                
-                if bank_res.data:
-                    bank_id = bank_res.data[0]['id']
-                    current_balance = float(bank_res.data[0].get('balance') or 0)
-                    new_balance = current_balance + amount
-                    
-                    supabase.table('admin_banks').update({'balance': new_balance}).eq('id', bank_id).execute()
-                    
-                    # INI KUNCINYA: Catat masuknya uang langganan ke Buku Besar!
-                    from app import log_bank_mutation # Import lokal biar aman
-                    log_bank_mutation(bank_id, 'INCOME', amount, current_balance, new_balance, f"Auto: Pembayaran {plan_name} User #{user_id}")
+            # 1-5. Cek transaksi, hitung expired baru, update user, tandai PAID, tambah saldo bank & catat mutasi
+            # Semua dieksekusi di Postgres dalam 1 transaksi (lihat sql/approve_transaction.sql)
+            try:
+                res = supabase.rpc('approve_transaction', {'p_trx': trx_id, 'p_admin': admin_id}).execute()
+            except Exception as rpc_e:
+                logger.error(f"Approval RPC Error: {rpc_e}")
+                # Pesan validasi (gak ketemu / udah PAID) dilempar dari RAISE EXCEPTION di SQL
+                return False, getattr(rpc_e, 'message', None) or str(rpc_e)
+
+            result = res.data or {}
+            user_id = result['user_id']
+            plan_name = result['plan_name']
+            invalidate_user_cache(user_id)
+            new_expiry = str(result['new_expiry'])
             
             # 6. Kirim Notif ke User
-            send_telegram_alert(user_id, f"✅ **Pembayaran Diterima!**\nPaket {plan_name} aktif sampai {new_expiry[:10]}.")
+            _NOTIF_POOL.submit(send_telegram_alert, user_id, f"✅ **Pembayaran Diterima!**\nPaket {plan_name} aktif sampai {new_expiry[:10]}.")
             
             return True, "Sukses Approve & Saldo Bank Terupdate"
         except Exception as e:
             logger.error(f"Approval Error: {e}")
             return False, str(e)
 
+# Batas atas (inklusif) tiap label durasi. Label terakhir = di atas batas paling gede.
+_DURATION_BUCKETS = [3, 35, 100]
+_DURATION_LABELS = ["Trial", "Bulanan", "Quarterly", "Semester"]
+
 def _get_duration_title(days):
-    if days <= 3: return "Trial"
-    if days <= 35: return "Bulanan"
-    if days <= 100: return "Quarterly"
-    return "Semester"
+    return _DURATION_LABELS[bisect_left(_DURATION_BUCKETS, days)]
 
 # ==========================================
 # SECTION 14 : IMPORT & EXPORT CSV
 # ==========================================
 
+# Pola header CSV -> key standar. Urutan = prioritas (match pertama yang menang).
+_HDR_PATTERNS = [
+    ('user_id', re.compile(r'user.*id|id.*user|userid', re.I)),
+    ('username', re.compile(r'user.*name|username|handle', re.I)),
+    ('first_name', re.compile(r'first.*name|name|nama', re.I)),
+]
+
+# Encoding CSV ditebak dari potongan awal file: UTF-8 valid -> utf-8-sig, selain itu anggap export Excel Windows
+CSV_SNIFF_BYTES = 64 * 1024
+
+def _sniff_csv_encoding(stream):
+    """Tebak encoding upload CSV tanpa baca full file (stream dibalikin ke awal)."""
+    head = stream.read(CSV_SNIFF_BYTES)
+    stream.seek(0)
+    try:
+        # final=False -> karakter multi-byte yang kepotong di ujung chunk gak dianggap error
+        codecs.getincrementaldecoder('utf-8-sig')().decode(head, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+# Buang awalan '@' / link t.me di kolom username (1x pass regex, http & https)
+_USERNAME_STRIP = re.compile(r'^@+|^https?://t\.me/', re.I)
+
+# Urutan kolom COPY untuk tele_users (harus sama persis dengan urutan tuple di copy_tele_users_rows)
+TELE_USERS_COPY_COLUMNS = "owner_id, user_id, username, first_name, source_phone, last_interaction, created_at"
+
+def get_bulk_db_connection():
+    """
+    Buka koneksi Postgres langsung untuk bulk import (COPY).
+    Return None kalau driver / DSN gak tersedia -> caller fallback ke upsert PostgREST.
+    """
+    if not psycopg2 or not SUPABASE_DB_URL: return None
+    try:
+        return psycopg2.connect(SUPABASE_DB_URL)
+    except Exception as e:
+        logger.warning(f"Bulk DB Connect Gagal, fallback ke PostgREST: {e}")
+        return None
+
+def copy_tele_users_rows(cur, rows):
+    """
+    Stream 1 batch kontak ke temp table tmp_tele_users pakai COPY FROM STDIN (format CSV).
+    rows = iterable tuple yang urutannya sama dengan TELE_USERS_COPY_COLUMNS.
+    """
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(f"COPY tmp_tele_users ({TELE_USERS_COPY_COLUMNS}) FROM STDIN WITH (FORMAT csv)", buf)
+
+def merge_tele_users_from_temp(cur):
+    """
+    Pindahin isi temp table ke tele_users dalam 1 statement INSERT ... ON CONFLICT.
+    ID dobel antar batch diambil yang paling akhir masuk (ctid terbesar), biar ON CONFLICT gak bentrok 2x.
+    """
+    cur.execute(f"""
+        INSERT INTO tele_users ({TELE_USERS_COPY_COLUMNS})
+        SELECT DISTINCT ON (owner_id, user_id) {TELE_USERS_COPY_COLUMNS} FROM tmp_tele_users
+        ORDER BY owner_id, user_id, ctid DESC
+        ON CONFLICT (owner_id, user_id) DO UPDATE SET
+            username = EXCLUDED.username,
+            first_name = EXCLUDED.first_name,
+            source_phone = EXCLUDED.source_phone,
+            last_interaction = EXCLUDED.last_interaction
+    """)
+
 @app.route('/import_crm_csv', methods=['POST'])
 @login_required
 def import_crm_csv():
@@ -4331,37 +5372,29 @@ def import_crm_csv():
     if not file.filename.lower().endswith('.csv'):
         return jsonify({"status": "error", "message": "Format file harus .csv"})
 
+    pg_conn = None
+    upsert_pool = None
+    pending = []
     try:
         # 2. Smart Encoding Reader (Handle Excel BOM issues)
-        # File CSV dari Excel seringkali punya karakter 'BOM' di awal yang bikin error
-        # Kita baca binary dulu, lalu decode paksa
-        file_content = file.stream.read()
-        
-        try:
-            decoded_content = file_content.decode('utf-8-sig') # Best for Excel
-        except UnicodeDecodeError:
-            try:
-                decoded_content = file_content.decode('latin-1') # Fallback
-            except:
-                return jsonify({"status": "error", "message": "Encoding file tidak dikenali. Gunakan UTF-8."})
-
-        # Siapkan Stream IO
-        stream = io.StringIO(decoded_content, newline=None)
-        csv_input = csv.DictReader(stream)
+        # File CSV dari Excel seringkali punya karakter 'BOM' di awal -> 'utf-8-sig' otomatis buang.
+        # Bukan UTF-8 (export Excel Windows) -> fallback cp1252 biar nama non-ASCII gak jadi '�'.
+        # File dibaca streaming baris per baris (gak di-load full ke RAM), byte aneh diganti biar gak crash.
+        text_stream = io.TextIOWrapper(file.stream, encoding=_sniff_csv_encoding(file.stream), newline='', errors='replace')
+        csv_input = csv.DictReader(text_stream)
 
         # 3. Normalisasi Header (Biar gak sensitif huruf besar/kecil)
         # Kita bikin map key standar: 'user_id', 'username', 'first_name'
         # Jadi user upload header 'User ID' atau 'USER_ID' tetap masuk
+        # Tiap kolom cuma di-scan 1x, kolom pertama yang cocok yang dipake (gak ketimpa kolom belakang)
         normalized_map = {}
-        if csv_input.fieldnames:
-            for field in csv_input.fieldnames:
-                clean_field = field.strip().lower().replace(" ", "_")
-                if "user" in clean_field and "id" in clean_field:
-                    normalized_map['user_id'] = field
-                elif "user" in clean_field and "name" in clean_field:
-                    normalized_map['username'] = field
-                elif "name" in clean_field or "nama" in clean_field:
-                    normalized_map['first_name'] = field
+        for field in csv_input.fieldnames or []:
+            clean_field = field.strip()
+            for key, pattern in _HDR_PATTERNS:
+                # Key yang udah keisi dilewatin -> kolom ini masih bisa jatuh ke pola berikutnya
+                if key not in normalized_map and pattern.search(clean_field):
+                    normalized_map[key] = field
+                    break
 
         # Cek Header Wajib
         if 'user_id' not in normalized_map:
@@ -4370,9 +5403,54 @@ def import_crm_csv():
                 "message": "Format CSV Tidak Valid! Tidak ditemukan kolom 'user_id' atau 'User ID'."
             })
 
-        valid_rows = []
+        # Jalur cepat: COPY ke temp table lalu 1x INSERT ... ON CONFLICT (kalau DSN Postgres diset)
+        pg_conn = get_bulk_db_connection()
+        pg_cur = None
+        if pg_conn:
+            pg_cur = pg_conn.cursor()
+            # Temp table cuma kolom yang di-COPY (LIKE ikut bawa NOT NULL di id tanpa default identity-nya)
+            pg_cur.execute(f"CREATE TEMP TABLE tmp_tele_users ON COMMIT DROP AS SELECT {TELE_USERS_COPY_COLUMNS} FROM tele_users WITH NO DATA")
+        else:
+            # Jalur PostgREST: beberapa batch di-upsert barengan (maks 6 in-flight biar RAM tetap kecil)
+            upsert_pool = ThreadPoolExecutor(max_workers=6, thread_name_prefix="csv_import")
+
+        def flush_batch(batch):
+            # batch = {user_id: (username, first_name)}, kolom lain sama semua -> baru dirakit di sini
+            if pg_cur:
+                copy_tele_users_rows(pg_cur, (
+                    (user_id, uid, uname, fname, source_phone, now_iso, now_iso)
+                    for uid, (uname, fname) in batch.items()
+                ))
+                return
+            # Urut by user_id -> urutan lock row konsisten antar batch paralel (anti deadlock)
+            rows = [
+                {**base_row, "user_id": uid, "username": uname, "first_name": fname}
+                for uid, (uname, fname) in sorted(batch.items())
+            ]
+            # Upsert: Update jika ID sudah ada, Insert jika belum
+            pending.append(upsert_pool.submit(
+                lambda: supabase.table('tele_users').upsert(rows, on_conflict="owner_id, user_id").execute()
+            ))
+            if len(pending) >= 6:
+                pending.pop(0).result()
+
+        # Flush per 1000 baris biar server gak timeout & RAM tetap kecil
+        batch_size = 1000
+        # Dedupe per user_id (baris terakhir yang menang) -> 1 upsert gak resolve konflik yg sama berkali-kali
+        valid_rows_by_uid = {}
+        total_inserted = 0
         errors = 0
         
+        # Semua baris dalam 1x import share timestamp yang sama
+        now_iso = datetime.utcnow().isoformat()
+        # Kolom yang sama untuk semua baris (cuma dipake jalur PostgREST)
+        base_row = {
+            "owner_id": user_id,
+            "source_phone": source_phone, # <--- PENTING: Masuk ke folder akun ini
+            "last_interaction": now_iso,
+            "created_at": now_iso
+        }
+
         # 4. Iterasi Data
         for row in csv_input:
             try:
@@ -4389,7 +5467,7 @@ def import_crm_csv():
                 if 'username' in normalized_map:
                     val = row.get(normalized_map['username'], '').strip()
                     # Bersihkan '@' atau link t.me/ jika user iseng masukin itu
-                    raw_username = val.replace("@", "").replace("https://t.me/", "") if val else None
+                    raw_username = _USERNAME_STRIP.sub('', val) if val else None
 
                 # Ambil Nama (Optional)
                 raw_name = "Imported Contact"
@@ -4397,35 +5475,34 @@ def import_crm_csv():
                     val = row.get(normalized_map['first_name'], '').strip()
                     if val: raw_name = val
 
-                # Susun Data Bersih
-                clean_data = {
-                    "owner_id": user_id,
-                    "user_id": int(raw_uid),
-                    "username": raw_username,
-                    "first_name": raw_name,
-                    "source_phone": source_phone, # <--- PENTING: Masuk ke folder akun ini
-                    "last_interaction": datetime.utcnow().isoformat(),
-                    "created_at": datetime.utcnow().isoformat()
-                }
-                valid_rows.append(clean_data)
+                # Simpan cuma bagian yang beda per baris
+                valid_rows_by_uid[int(raw_uid)] = (raw_username, raw_name)
                 
             except Exception:
                 errors += 1
                 continue
 
-        if not valid_rows:
-            return jsonify({"status": "error", "message": "File terbaca kosong atau semua User ID tidak valid."})
+            # 5. Kirim batch ke Database begitu penuh
+            if len(valid_rows_by_uid) >= batch_size:
+                flush_batch(valid_rows_by_uid)
+                total_inserted += len(valid_rows_by_uid)
+                valid_rows_by_uid = {}
 
-        # 5. Batch Upsert ke Database (Supabase)
-        # Insert per 1000 baris biar server gak timeout
-        batch_size = 1000
-        total_inserted = 0
-        
-        for i in range(0, len(valid_rows), batch_size):
-            batch = valid_rows[i:i + batch_size]
-            # Upsert: Update jika ID sudah ada, Insert jika belum
-            supabase.table('tele_users').upsert(batch, on_conflict="owner_id, user_id").execute()
-            total_inserted += len(batch)
+        # Flush sisa batch terakhir
+        if valid_rows_by_uid:
+            flush_batch(valid_rows_by_uid)
+            total_inserted += len(valid_rows_by_uid)
+
+        # Tunggu semua upsert paralel kelar (error batch manapun dilempar ke sini)
+        for fut in pending:
+            fut.result()
+
+        if pg_cur:
+            merge_tele_users_from_temp(pg_cur)
+            pg_conn.commit()
+
+        if total_inserted == 0:
+            return jsonify({"status": "error", "message": "File terbaca kosong atau semua User ID tidak valid."})
 
         # 6. Response Sukses
         msg = f"Sukses import {total_inserted} kontak ke database {source_phone}."
@@ -4437,6 +5514,10 @@ def import_crm_csv():
     except Exception as e:
         logger.error(f"CSV Import Critical Error: {e}")
         return jsonify({"status": "error", "message": f"Server Error: {str(e)}"})
+    finally:
+        # Koneksi COPY ditutup apapun hasilnya (yang belum di-commit otomatis rollback)
+        if pg_conn: pg_conn.close()
+        if upsert_pool: upsert_pool.shutdown(wait=True, cancel_futures=True)
 
 @app.route('/export_crm_csv')
 @login_required
@@ -4446,49 +5527,60 @@ def export_crm_csv():
     # Tangkap parameter folder dari URL
     source = request.args.get('source', 'all')
     
-    try:
-        # Base Query
-        query = supabase.table('tele_users').select("user_id, username, first_name, last_interaction, source_phone").eq('owner_id', user_id)
-        
-        # Kalau gak pilih "Semua Database", filter berdasarkan foldernya
-        if source and source != 'all':
-            query = query.eq('source_phone', source)
-            
-        res = query.execute()
-        data = res.data if res.data else []
-        
-        # Bikin CSV di memori
+    # Ukuran 1 halaman query -> RAM cuma nampung 1 halaman, bukan seluruh tabel
+    page_size = 5000
+
+    def generate():
         si = io.StringIO()
         cw = csv.writer(si)
-        
+
         # Header CSV
         cw.writerow(['user_id', 'username', 'first_name', 'last_interaction', 'source_phone'])
-        
-        # Isi Data
-        for row in data:
-            cw.writerow([
-                row.get('user_id'),
-                row.get('username') or '',
-                row.get('first_name') or '',
-                row.get('last_interaction') or '',
-                row.get('source_phone') or 'Unknown'
-            ])
-            
-        output = si.getvalue()
-        
-        # Nama file dinamis ngikutin folder
-        filename_suffix = "semua_database" if source == 'all' else source.replace('+', '')
-        
-        return Response(
-            output,
-            mimetype="text/csv",
-            headers={"Content-disposition": f"attachment; filename=crm_leads_{filename_suffix}_{datetime.now().strftime('%Y%m%d')}.csv"}
-        )
-        
-    except Exception as e:
-        flash(f"Gagal export: {e}", "danger")
-        return redirect(url_for('dashboard_crm'))
-        
+        yield si.getvalue()
+
+        last_id = None
+        try:
+            while True:
+                # Keyset pagination: lanjut dari user_id terakhir (gak pake OFFSET yg makin lama makin berat)
+                query = supabase.table('tele_users').select("user_id, username, first_name, last_interaction, source_phone").eq('owner_id', user_id)
+
+                # Kalau gak pilih "Semua Database", filter berdasarkan foldernya
+                if source and source != 'all':
+                    query = query.eq('source_phone', source)
+                if last_id is not None:
+                    query = query.gt('user_id', last_id)
+
+                rows = query.order('user_id').limit(page_size).execute().data or []
+                if not rows: break
+
+                # Isi Data (buffer di-reset tiap halaman)
+                si.seek(0)
+                si.truncate(0)
+                for row in rows:
+                    cw.writerow([
+                        row.get('user_id'),
+                        row.get('username') or '',
+                        row.get('first_name') or '',
+                        row.get('last_interaction') or '',
+                        row.get('source_phone') or 'Unknown'
+                    ])
+                yield si.getvalue()
+
+                if len(rows) < page_size: break
+                last_id = rows[-1]['user_id']
+        except Exception as e:
+            # Header udah kekirim, gak bisa flash/redirect lagi -> cukup dicatat
+            logger.error(f"CSV Export Error (user {user_id}): {e}")
+
+    # Nama file dinamis ngikutin folder
+    filename_suffix = "semua_database" if source == 'all' else source.replace('+', '')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-disposition": f"attachment; filename=crm_leads_{filename_suffix}_{datetime.now().strftime('%Y%m%d')}.csv"}
+    )
+
 # ==============================================================================
 # SECTION 15: INITIALIZATION ROUTINE
 # ==============================================================================
@@ -4501,29 +5593,14 @@ def init_system_check():
     if supabase:
         try:
             logger.info(f"⚙️ System Startup: Checking Admin ({adm_email})...")
-            res = supabase.table('users').select("id").eq('email', adm_email).execute()
-            
-            new_hash = generate_password_hash(adm_pass)
-            
-            if not res.data:
-                # Create Admin
-                data = {
-                    'email': adm_email, 
-                    'password': new_hash, 
-                    'is_admin': True, 
-                    'created_at': datetime.utcnow().isoformat()
-                }
-                supabase.table('users').insert(data).execute()
-                logger.info("👑 Super Admin Account Created Successfully")
-            else:
-                # Sync Admin Password from Env
-                uid = res.data[0]['id']
-                supabase.table('users').update({
-                    'password': new_hash, 
-                    'is_admin': True
-                }).eq('id', uid).execute()
-                logger.info("🔄 Admin Password Synced with Environment")
-                
+            # 1x upsert by email: bikin admin kalau belum ada, sync password dari env kalau udah ada
+            # (created_at gak dikirim -> diisi default kolom pas insert, gak ketimpa tiap boot)
+            supabase.table('users').upsert({
+                'email': adm_email, 
+                'password': generate_password_hash(adm_pass), 
+                'is_admin': True
+            }, on_conflict='email').execute()
+            logger.info("👑 Super Admin Synced with Environment")
         except Exception as e:
             logger.warning(f"⚠️ Admin Init Warning: {e}")
 
@@ -3,6 +3,8 @@ import asyncio
 import logging
 import math
 from datetime import datetime, timedelta
+import atexit
+import httpx
 import pytz
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -14,7 +16,7 @@ from telegram.ext import (
     filters
 )
 from telegram.error import BadRequest, Forbidden, Conflict
-from supabase import create_client
+from supabase import create_client, ClientOptions
 
 # ==============================================================================
 # CONFIGURATION & SETUP
@@ -31,8 +33,16 @@ if not BOT_TOKEN:
     BOT_TOKEN = "DUMMY_TOKEN_TO_PREVENT_CRASH"
 
 # Initialize Database
+# Pool koneksi keep-alive (HTTP/2) kayak di app.py -> query bot gak handshake TLS ulang tiap command
 try:
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    _SUPABASE_HTTP = httpx.Client(
+        http2=True,
+        timeout=120,
+        follow_redirects=True,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=300)
+    )
+    atexit.register(_SUPABASE_HTTP.close)
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=_SUPABASE_HTTP))
 except Exception as e:
     print(f"❌ Database Connection Failed in Bot: {e}")
     supabase = None
@@ -105,14 +115,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         token = args[0]
         try:
             # Cari user dengan token verifikasi ini
-            res = supabase.table('users').select("id, email").eq('verification_token', token).execute()
+            # Token cuma berlaku sampai verification_token_expires_at (diset dashboard profile, 24 jam)
+            res = supabase.table('users').select("id, email").eq('verification_token', token)\
+                .gt('verification_token_expires_at', datetime.now(pytz.utc).isoformat()).execute()
             
             if res.data:
                 db_user = res.data[0]
                 # Update DB: Link Chat ID & Hapus Token
                 supabase.table('users').update({
                     'notification_chat_id': chat_id,
-                    'verification_token': None 
+                    'verification_token': None,
+                    'verification_token_expires_at': None
                 }).eq('id', db_user['id']).execute()
                 
                 await update.message.reply_text(
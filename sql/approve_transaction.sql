@@ -0,0 +1,78 @@
+-- ==============================================================================
+-- RPC: approve_transaction
+-- Dipanggil dari FinanceManager.approve_transaction (app.py) via supabase.rpc().
+-- Semua langkah approve (cek transaksi, hitung expired baru, update user,
+-- tandai transaksi PAID, tambah saldo bank + catat mutasi) jalan dalam
+-- 1 transaksi Postgres -> 1 round-trip & atomik.
+-- ==============================================================================
+
+CREATE OR REPLACE FUNCTION approve_transaction(p_trx uuid, p_admin bigint)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_trx        transactions%ROWTYPE;
+    v_duration   integer;
+    v_plan_name  text;
+    v_new_expiry timestamptz;
+    v_bank_id    admin_banks.id%TYPE;
+    v_balance    numeric;
+BEGIN
+    -- Kunci baris transaksi biar 2 admin gak bisa approve barengan
+    SELECT * INTO v_trx FROM transactions WHERE id = p_trx FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Transaksi tidak ditemukan';
+    END IF;
+
+    IF v_trx.status = 'paid' THEN
+        RAISE EXCEPTION 'Transaksi ini sudah pernah di-approve sebelumnya!';
+    END IF;
+
+    SELECT pv.duration_days, pp.display_name
+      INTO v_duration, v_plan_name
+      FROM pricing_variants pv
+      JOIN pricing_plans pp ON pp.id = pv.plan_id
+     WHERE pv.id = v_trx.plan_variant_id;
+
+    -- Perpanjang dari tanggal expired lama kalau masih aktif, kalau udah lewat mulai dari sekarang
+    UPDATE users
+       SET plan_tier = v_plan_name,
+           subscription_end = GREATEST(COALESCE(subscription_end, now()), now()) + make_interval(days => v_duration)
+     WHERE id = v_trx.user_id
+    RETURNING subscription_end INTO v_new_expiry;
+
+    UPDATE transactions
+       SET status = 'paid',
+           admin_note = format('Approved by Admin #%s at %s', p_admin, now())
+     WHERE id = p_trx;
+
+    -- Saldo bank tujuan (dicocokin dari nama metode bayar) + catat ke buku besar
+    IF COALESCE(v_trx.payment_method, '') <> '' THEN
+        SELECT id, COALESCE(balance, 0)
+          INTO v_bank_id, v_balance
+          FROM admin_banks
+         WHERE bank_name ILIKE '%' || v_trx.payment_method || '%'
+         LIMIT 1
+           FOR UPDATE;
+
+        IF FOUND THEN
+            UPDATE admin_banks
+               SET balance = v_balance + v_trx.amount
+             WHERE id = v_bank_id;
+
+            INSERT INTO bank_mutations (bank_id, mutation_type, amount, balance_before, balance_after, description, created_at)
+            VALUES (v_bank_id, 'INCOME', v_trx.amount, v_balance, v_balance + v_trx.amount,
+                    format('Auto: Pembayaran %s User #%s', v_plan_name, v_trx.user_id), now());
+        END IF;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'user_id', v_trx.user_id,
+        'plan_name', v_plan_name,
+        'new_expiry', v_new_expiry,
+        'amount', v_trx.amount,
+        'payment_method', v_trx.payment_method
+    );
+END;
+$$;
@@ -0,0 +1,15 @@
+-- ==============================================================================
+-- INDEX: auto_reply_settings (user_id, target_phone)
+-- Dibutuhkan AutoReplyManager.update_settings (app.py) yang simpan settingan via
+-- upsert(on_conflict="user_id, target_phone") -> 1 statement INSERT ... ON CONFLICT.
+-- ==============================================================================
+
+-- Bersihin duplikat lama dulu (sisain row dengan id terbesar / paling baru)
+DELETE FROM auto_reply_settings a
+ USING auto_reply_settings b
+ WHERE a.user_id = b.user_id
+   AND a.target_phone = b.target_phone
+   AND a.id < b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS auto_reply_settings_user_target_key
+    ON auto_reply_settings (user_id, target_phone);
@@ -0,0 +1,21 @@
+-- ==============================================================================
+-- RPC: blast_log_stats
+-- Total log + log SUCCESS milik 1 user dalam 1 scan (COUNT ... FILTER).
+-- Dipakai dashboard_overview (app.py), gantiin 2 request count='exact' terpisah.
+-- ==============================================================================
+
+-- Index (user_id, status) biar 2 count di bawah cukup index-only scan
+-- (DB production gede? jalanin manual pake CREATE INDEX CONCURRENTLY di luar transaksi)
+CREATE INDEX IF NOT EXISTS blast_logs_user_status_idx
+    ON blast_logs (user_id, status);
+
+CREATE OR REPLACE FUNCTION blast_log_stats(uid bigint)
+RETURNS TABLE (total bigint, ok bigint)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COUNT(*) AS total,
+           COUNT(*) FILTER (WHERE status = 'SUCCESS') AS ok
+      FROM blast_logs
+     WHERE user_id = uid;
+$$;
@@ -0,0 +1,9 @@
+-- ==============================================================================
+-- INDEX: pagination keyset blast_logs (dashboard_overview)
+-- Tombol Prev/Next di dashboard bawa cursor (created_at, id) dari halaman sebelumnya,
+-- jadi tiap halaman = index range scan per_page baris, gak OFFSET yang nge-scan
+-- lalu buang semua baris halaman-halaman sebelumnya.
+-- ==============================================================================
+
+CREATE INDEX IF NOT EXISTS idx_blast_logs_user_created_id
+    ON blast_logs (user_id, created_at DESC, id DESC);
@@ -0,0 +1,23 @@
+-- ==============================================================================
+-- RPC: claim_welcome
+-- Cek cooldown welcome message + catat waktu balas dalam 1 statement atomik.
+-- Return TRUE kalau sender udah lewat cooldown (timestamp langsung di-klaim),
+-- FALSE kalau masih dalam masa cooldown. 2 pesan barengan gak bisa sama-sama lolos.
+-- Dipakai AutoReplyService (app.py), butuh unique (user_id, sender_id) di reply_logs
+-- (udah dipakai juga sama upsert on_conflict="user_id, sender_id").
+-- ==============================================================================
+
+CREATE OR REPLACE FUNCTION claim_welcome(p_user_id bigint, p_sender_id bigint, p_cooldown_min int)
+RETURNS boolean
+LANGUAGE sql
+AS $$
+    WITH claimed AS (
+        INSERT INTO reply_logs (user_id, sender_id, last_reply_at)
+        VALUES (p_user_id, p_sender_id, now())
+        ON CONFLICT (user_id, sender_id) DO UPDATE
+            SET last_reply_at = EXCLUDED.last_reply_at
+            WHERE reply_logs.last_reply_at < now() - make_interval(mins => p_cooldown_min)
+        RETURNING 1
+    )
+    SELECT EXISTS (SELECT 1 FROM claimed);
+$$;
@@ -0,0 +1,14 @@
+-- ==============================================================================
+-- MIGRASI SEKALI JALAN: rapihin blast_targets.topic_ids ke format baku "123,456"
+-- App sekarang nyimpen topic_ids udah bersih (normalize_topic_ids di app.py),
+-- script ini nyamain data lama biar scheduler gak perlu parsing ulang tiap jalan.
+-- ==============================================================================
+
+UPDATE blast_targets
+   SET topic_ids = NULLIF(array_to_string(ARRAY(
+           SELECT trim(u.x)
+             FROM unnest(string_to_array(topic_ids, ',')) WITH ORDINALITY AS u(x, ord)
+            WHERE trim(u.x) ~ '^[0-9]+$'
+            ORDER BY u.ord
+       ), ','), '')
+ WHERE topic_ids IS NOT NULL;
@@ -0,0 +1,17 @@
+-- ==============================================================================
+-- INDEX: pencarian CRM (tele_users.username / tele_users.first_name)
+-- dashboard_crm nyari pakai ILIKE '%q%'. Wildcard di depan gak bisa pakai b-tree,
+-- jadi tanpa index ini tiap search = sequential scan semua kontak.
+-- GIN + pg_trgm bisa dipakai planner langsung buat ILIKE '%q%' (minimal 3 huruf),
+-- termasuk kombinasi OR username/first_name (BitmapOr).
+-- Cek: EXPLAIN ANALYZE SELECT id FROM tele_users
+--      WHERE owner_id = 1 AND (username ILIKE '%abc%' OR first_name ILIKE '%abc%');
+-- ==============================================================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_tele_users_username_trgm
+    ON tele_users USING gin (username gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_tele_users_first_name_trgm
+    ON tele_users USING gin (first_name gin_trgm_ops);
@@ -0,0 +1,30 @@
+-- ==============================================================================
+-- KOLOM: telegram_accounts.login_state & telegram_accounts.phone_code_hash
+-- Dulu hash OTP numpang di kolom `targets` dan verify_code nyari row pending pakai
+-- neq('targets', '[]'). Sekarang status login punya kolom sendiri:
+--   'pending_otp' -> OTP udah dikirim (send_code), nunggu verify_code
+--   'active'      -> login selesai (OTP / QR)
+-- ==============================================================================
+
+ALTER TABLE telegram_accounts
+    ADD COLUMN IF NOT EXISTS login_state text,
+    ADD COLUMN IF NOT EXISTS phone_code_hash text;
+
+-- Pindahin sesi OTP yang lagi nunggu dari format lama
+UPDATE telegram_accounts
+SET login_state = 'pending_otp',
+    phone_code_hash = trim(both '"' from targets::text)  -- aman buat kolom text maupun jsonb
+WHERE is_active = false
+  AND targets IS NOT NULL
+  AND targets::text <> '[]'
+  AND login_state IS NULL;
+
+UPDATE telegram_accounts
+SET login_state = 'active'
+WHERE is_active = true
+  AND login_state IS NULL;
+
+-- Index parsial: cuma row yang lagi nunggu OTP (jumlahnya kecil)
+CREATE INDEX IF NOT EXISTS idx_telegram_accounts_pending_otp
+    ON telegram_accounts (user_id, created_at DESC)
+    WHERE login_state = 'pending_otp';
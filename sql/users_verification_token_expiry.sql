@@ -0,0 +1,9 @@
+-- ==============================================================================
+-- KOLOM: users.verification_token_expires_at
+-- Token deep-link bot notif sekarang dipake ulang sampai expired (24 jam),
+-- gak di-generate + ditulis ulang tiap buka halaman profile (app.py dashboard_profile).
+-- bot.py cuma nerima token yang belum lewat waktu ini.
+-- ==============================================================================
+
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS verification_token_expires_at timestamptz;
@@ -0,0 +1,31 @@
+-- ==============================================================================
+-- VIEW: v_active_autoreply
+-- Akun Telegram aktif yang punya settingan auto-reply ON untuk nomornya sendiri.
+-- Dipakai AutoReplyService._main_supervisor (app.py): 1 query per patroli,
+-- gantiin 2 query (telegram_accounts + auto_reply_settings) & join manual di Python.
+-- Nomor HP dinormalisasi sama kayak AutoReplyManager.normalize_phone (buang spasi/strip, wajib "+").
+-- ==============================================================================
+
+CREATE OR REPLACE FUNCTION normalize_phone(p text)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN p IS NULL OR p = 'all' THEN 'all'
+        WHEN left(btrim(translate(p, ' -', '')), 1) = '+' THEN btrim(translate(p, ' -', ''))
+        ELSE '+' || btrim(translate(p, ' -', ''))
+    END;
+$$;
+
+CREATE OR REPLACE VIEW v_active_autoreply AS
+SELECT ta.*
+  FROM telegram_accounts ta
+ WHERE ta.is_active = TRUE
+   AND EXISTS (
+        SELECT 1
+          FROM auto_reply_settings ars
+         WHERE ars.user_id = ta.user_id
+           AND ars.is_active = TRUE
+           AND normalize_phone(ars.target_phone) = normalize_phone(ta.phone_number)
+   );